@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Measure how many tiny jobs per second a WorkQueue can hand out and retire as
+the number of worker threads grows.
+
+    python benchmarks/bench_work_queue.py --jobs 20000 --workers 1 4 16 64 256
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ilmklib import Graph, WorkQueue
+
+
+def make_graph(n):
+    # n sources, each compiled into an object, all linked into one binary
+    g = Graph()
+    g["bin"] = "file"
+    for i in range(n):
+        g[f"{i}.c"] = "file"
+        g[f"{i}.o"] = "file"
+        g.add_edge(f"{i}.o", f"{i}.c")
+        g.add_edge("bin", f"{i}.o")
+
+    files = {f"{i}.c": 1 for i in range(n)}
+    return g, files
+
+
+def run(n, workers):
+
+    g, files = make_graph(n)
+    wq = WorkQueue(g, {"file": lambda x: files.get(x, -1)})
+    wq.activate("bin")
+
+    def worker():
+        while True:
+            item = wq.get_item(wait=True)
+            if item is None:
+                return
+            files[item] = 2
+            wq.mark_done(item)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    assert wq.done() and not wq.error
+    return (n + 1) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=20000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 16, 64, 256])
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'jobs/s':>12}")
+    for w in args.workers:
+        print(f"{w:>8} {run(args.jobs, w):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Generators for synthetic build graphs.
+
+Each generator returns `(vertices, edges)` where edges are `(dst, src)` pairs,
+in the same order as `Graph.add_edge` takes them. Every shape has a single
+sink vertex called "all" that depends on everything that has no successors,
+so it can be passed to `WorkQueue.activate`. The same seed always gives the
+same graph.
+"""
+
+import random
+
+from ilmklib import Graph
+
+
+def _add_sink(vertices, edges):
+    has_successor = {src for _, src in edges}
+    outputs = [v for v in vertices if v not in has_successor]
+    vertices.append("all")
+    edges.extend(("all", v) for v in outputs)
+    return vertices, edges
+
+
+def fan_in(n_sources, n_headers, headers_per_source, seed=0):
+    '''
+    C-like project: every source compiles to an object that includes a
+    random set of headers drawn from a shared pool.
+    '''
+    rng = random.Random(seed)
+    headers = [f"h{i}.h" for i in range(n_headers)]
+    vertices = list(headers)
+    edges = []
+    for i in range(n_sources):
+        vertices.append(f"s{i}.c")
+        vertices.append(f"s{i}.o")
+        edges.append((f"s{i}.o", f"s{i}.c"))
+        for h in rng.sample(headers, min(headers_per_source, n_headers)):
+            edges.append((f"s{i}.o", h))
+
+    return _add_sink(vertices, edges)
+
+
+def chains(n_chains, depth):
+    '''
+    Independent serial chains, e.g. generated files feeding each other.
+    '''
+    vertices = []
+    edges = []
+    for c in range(n_chains):
+        for d in range(depth):
+            vertices.append(f"c{c}_{d}")
+            if d:
+                edges.append((f"c{c}_{d}", f"c{c}_{d - 1}"))
+
+    return _add_sink(vertices, edges)
+
+
+def random_dag(n, edges_per_vertex, seed=0):
+    '''
+    Random DAG: every vertex depends on a few vertices with a lower index.
+    '''
+    rng = random.Random(seed)
+    vertices = [f"r{i}" for i in range(n)]
+    edges = []
+    for i in range(1, n):
+        for j in set(rng.randrange(i) for _ in range(edges_per_vertex)):
+            edges.append((f"r{i}", f"r{j}"))
+
+    return _add_sink(vertices, edges)
+
+
+def diamonds(layers, width, seed=0):
+    '''
+    Layers of vertices where each depends on two vertices of the previous
+    layer, giving many reconverging paths.
+    '''
+    rng = random.Random(seed)
+    vertices = []
+    edges = []
+    for l in range(layers):
+        for w in range(width):
+            vertices.append(f"d{l}_{w}")
+            if l:
+                for p in set(rng.sample(range(width), 2)):
+                    edges.append((f"d{l}_{w}", f"d{l - 1}_{p}"))
+
+    return _add_sink(vertices, edges)
+
+
+def build(vertices, edges, value="file"):
+    g = Graph()
+    for v in vertices:
+        g.add_vertex(v, value)
+    for dst, src in edges:
+        g.add_edge(dst, src)
+    return g
+
+
+def shapes(scale=1):
+    '''
+    The standard set of shapes used by the benchmark suite. `scale`
+    multiplies their size; scale=20 gets the largest one past a million
+    edges.
+    '''
+    return {
+        "fan_in": fan_in(2000 * scale, 500, 40),
+        "chains": chains(20 * scale, 500),
+        "random_dag": random_dag(5000 * scale, 5),
+        "diamonds": diamonds(100, 50 * scale),
+    }
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Time the build engine on synthetic graphs and compare against a baseline.
+
+    python benchmarks/run.py --save baseline.json
+    python benchmarks/run.py --compare baseline.json --threshold 1.25
+
+Exits with a non-zero status when any case is slower than the baseline by
+more than the threshold factor.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ilmklib import TimestampDict, WorkQueue
+
+from generators import build, shapes
+
+
+def timed(results, name, func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        o = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    results[name] = best
+    print(f"{name:<40} {best * 1000:>10.2f} ms", flush=True)
+    return o
+
+
+def bench_graph(results, name, vertices, edges, repeat):
+
+    print(f"# {name}: {len(vertices)} vertices, {len(edges)} edges", flush=True)
+    g = timed(results, f"{name}/construct", lambda: build(vertices, edges), repeat)
+    timed(results, f"{name}/is_cyclic", g.is_cyclic, repeat)
+    timed(results, f"{name}/all_predecessors",
+          lambda: sum(1 for _ in g.get_all_predecessors("all")), repeat)
+
+    # Every vertex with no predecessors exists, everything else must be built
+    files = {v: 1 for v in g.leaf_nodes}
+
+    def analysis():
+        wq = WorkQueue(g, {"file": lambda x: files.get(x, -1)})
+        wq.activate("all")
+        return wq
+
+    timed(results, f"{name}/analysis", analysis, repeat)
+
+    def drain():
+        built = {}
+        wq = WorkQueue(g, {"file": lambda x: built.get(x, files.get(x, -1))})
+        wq.activate("all")
+        while True:
+            item = wq.get_item()
+            if item is None:
+                break
+            built[item] = 2
+            wq.mark_done(item)
+        return wq
+
+    wq = timed(results, f"{name}/analysis+drain", drain, repeat)
+    timed(results, f"{name}/get_updated", lambda: list(wq.get_updated()), repeat)
+
+
+def bench_timestamp_dict(results, n, repeat):
+
+    print(f"# timestamp_dict: {n} keys", flush=True)
+    with tempfile.TemporaryDirectory() as d:
+        for i in range(n):
+            with open(os.path.join(d, f"key{i}"), "w") as f:
+                f.write(f"value{i}\n")
+
+        def load():
+            t = TimestampDict()
+            t.loadkeydir(d)
+            return t
+
+        timed(results, "timestamp_dict/loadkeydir", load, repeat)
+
+        def store():
+            t = TimestampDict()
+            for i in range(n):
+                t[f"key{i}"] = f"value{i}"
+            return t
+
+        timed(results, "timestamp_dict/set", store, repeat)
+
+
+def compare(results, baseline, threshold):
+    slower = []
+    for name, t in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = t / baseline[name]
+        flag = ""
+        if ratio > threshold:
+            slower.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40} {ratio:>6.2f}x{flag}")
+
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument("--compare", help="compare against results saved with --save")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = {}
+    for name, (vertices, edges) in shapes(args.scale).items():
+        bench_graph(results, name, vertices, edges, args.repeat)
+    bench_timestamp_dict(results, 2000 * args.scale, args.repeat)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Graph.tarjans and WorkQueue analysis recurse once per vertex on the
+    # longest path, so give them room on the deep shapes.
+    sys.setrecursionlimit(1000000)
+    threading.stack_size(512 * 1024 * 1024)
+    t = threading.Thread(target=main)
+    t.start()
+    t.join()
@@ -1,6 +1,14 @@
 
 from .work_queue import WorkQueue
-from .graph import Graph
+from .graph import Graph, Shard, NORMAL, ORDER_ONLY
 from .cc import makedeps
-from .unique_stack import UniqueStack
-from .timestamp_dict import TimestampDict
+from .unique_stack import UniqueStack, IntUniqueStack
+from .timestamp_dict import TimestampDict, SharedTimestampDict
+from .server import BuildServer
+from .trace import Tracer
+from .metrics import metrics, Metrics
+from .distributed import Coordinator, run_worker
+from .action_cache import ActionCache
+from .resources import ResourcePool
+from .jobserver import JobserverClient, JobserverServer
+from .parallel import parallel_tarjans, parallel_is_cyclic, parallel_analyze
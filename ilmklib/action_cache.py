@@ -0,0 +1,177 @@
+
+import fcntl
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+class ActionCache:
+    """
+    Content-addressed cache for the outputs of a Graph's items.
+
+    The key of an item is made of its rule type (the vertex value), the
+    command that builds it as returned by `command_func(item)` and the names
+    and contents of its direct predecessors, apart from order-only ones. If `command_func` returns None
+    the item is never cached.
+
+    All the outputs of a multi-output group (see `Graph.add_group`) are
+    stored and restored together, under one key whichever of them was handed
+    out.
+
+    Entries are stored as files in `directory`, written atomically, so the
+    directory can be shared between builds and machines. Restored outputs are
+    reflinked where the filesystem supports it and copied otherwise. Pass
+    `hardlink=True` to hardlink them instead; only do that if every action
+    replaces its output rather than rewriting it in place, or the cache entry
+    gets rewritten too.
+    """
+
+    def __init__(self, directory, graph, command_func, hardlink=False):
+
+        self.directory = directory
+        self.g = graph
+        self.command_func = command_func
+        self.hardlink = hardlink
+
+        # path -> (mtime, size, digest) so that unchanged inputs aren't hashed
+        # again for every item using them
+        self.digests = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _digest(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            # Not a file (e.g. a phony target), only its name counts
+            return ""
+
+        if not stat.S_ISREG(st.st_mode):
+            # e.g. a directory, only its name counts as well
+            return ""
+
+        cached = self.digests.get(path)
+        if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return cached[2]
+
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+
+        digest = h.hexdigest()
+        self.digests[path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def _outputs(self, item):
+        return self.g.groups.get(item, (item,))
+
+    def key(self, item):
+        outputs = self._outputs(item)
+        # The same for every output of a group
+        item = outputs[0]
+
+        command = self.command_func(item)
+        if command is None:
+            return None
+
+        # Order-only predecessors (e.g. the output directory) don't change
+        # the output
+        preds = set()
+        for o in outputs:
+            preds.update(x for x in self.g.get_direct_predecessors(o) if not self.g.is_order_only(o, x))
+        preds.difference_update(outputs)
+
+        h = hashlib.sha256()
+        h.update(repr((str(self.g[item]), command)).encode())
+        if len(outputs) > 1:
+            h.update(repr([str(x) for x in outputs]).encode())
+        for pred in sorted(preds, key=str):
+            h.update(repr((str(pred), self._digest(pred))).encode())
+
+        return h.hexdigest()
+
+    def _path(self, key, index=0):
+        # Outputs of a group after the first one get a suffix
+        name = key if index == 0 else f"{key}.{index}"
+        return os.path.join(self.directory, key[:2], name)
+
+    def _place(self, src, dst, allow_hardlink):
+        '''
+        Atomically put a copy of src at dst.
+        '''
+        d = os.path.dirname(dst) or "."
+        fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-")
+        os.close(fd)
+        try:
+            if allow_hardlink:
+                os.unlink(tmp)
+                os.link(src, tmp)
+            else:
+                try:
+                    _reflink(src, tmp)
+                except OSError:
+                    shutil.copyfile(src, tmp)
+            os.replace(tmp, dst)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def restore(self, item):
+        '''
+        Put the cached output of item in place. Returns whether there was one.
+        '''
+        key = self.key(item)
+        if key is None:
+            return False
+
+        outputs = self._outputs(item)
+        entries = [self._path(key, i) for i in range(len(outputs))]
+        if not all(os.path.exists(x) for x in entries):
+            return False
+
+        for entry, o in zip(entries, outputs):
+            try:
+                self._place(entry, o, self.hardlink)
+            except OSError:
+                if not self.hardlink:
+                    raise
+                # Different filesystem
+                self._place(entry, o, False)
+
+            # The output must end up newer than its inputs
+            os.utime(o, None)
+
+        return True
+
+    def store(self, item):
+        '''
+        Save the output of item after it was built.
+        '''
+        key = self.key(item)
+        if key is None:
+            return
+
+        # Only complete groups are stored, so that restoring never leaves an
+        # output missing
+        outputs = self._outputs(item)
+        if not all(os.path.isfile(x) for x in outputs):
+            return
+
+        os.makedirs(os.path.dirname(self._path(key)), exist_ok=True)
+        # The first entry is written last, restore looks for it first
+        for i in reversed(range(len(outputs))):
+            entry = self._path(key, i)
+            if not os.path.exists(entry):
+                self._place(outputs[i], entry, False)
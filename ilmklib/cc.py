@@ -2,6 +2,8 @@
 import subprocess
 import re
 
+from .metrics import metrics
+
 prod_re = re.compile("^([^:]+):")
 prereq_re = re.compile(r"\s*(?!\\)\S+\s*")
 
@@ -41,7 +43,8 @@ def makedeps(filename, include_dirs=None, show_system_headers=False, compiler="c
 
     try:
         cmd = [compiler, opt, filename] + inc_list
-        o = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode()
+        with metrics.timer("cc_spawns"):
+            o = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode()
     except subprocess.CalledProcessError as e:
         print(e.stdout.decode())
         raise e
@@ -0,0 +1,267 @@
+
+import json
+import socket
+import threading
+import time
+
+
+def _listen(address):
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    sock.bind(address)
+    sock.listen()
+    # Closing a listening socket doesn't reliably wake up accept(), so it
+    # polls instead.
+    sock.settimeout(0.1)
+    return sock
+
+
+def _connect(address):
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(address)
+    return sock
+
+
+def _close(sock):
+    # Closing alone doesn't wake up threads blocked on the socket, nor does
+    # it close it while a makefile() object is still alive.
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+
+def _send(sock, msg):
+    sock.sendall((json.dumps(msg) + "\n").encode())
+
+
+class Coordinator:
+    """
+    Hand the ready items of a WorkQueue out to worker processes over a socket.
+
+    `address` is a path for a Unix socket or a (host, port) tuple for TCP.
+    Messages are JSON objects, one per line, so item names must be strings.
+
+    A worker asks for work with `get` and is answered with `item` or, once
+    the queue is done, `finished`. It reports back with `done` (carrying the
+    new timestamp of the item, which is used instead of probing it locally)
+    or `error`, which are acknowledged with `ack`. While it holds an item a
+    worker must send `heartbeat` more often than `heartbeat_timeout`, or it
+    is dropped and its items are handed to someone else. Items held by a
+    worker whose connection closes are handed out again as well.
+    """
+
+    def __init__(self, wq, address, heartbeat_timeout=10.0):
+
+        self.wq = wq
+        self.address = address
+        self.heartbeat_timeout = heartbeat_timeout
+
+        self.lock = threading.Lock()
+        self.assigned = {}
+        self.last_seen = {}
+        self.conns = {}
+        self.next_id = 0
+
+        self.listener = None
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def start(self):
+        self.listener = _listen(self.address)
+        # Resolves port 0 to the port actually used
+        self.address = self.listener.getsockname()
+
+        for target in (self._accept_loop, self._monitor_loop):
+            t = threading.Thread(target=target, daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def wait(self, timeout=None):
+        '''
+        Wait until the WorkQueue is done. Returns False on timeout.
+        '''
+        # Waiting on wq.cond would swallow notifications meant for the
+        # connection threads handing out items, so poll instead.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.wq.done():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+
+        return True
+
+    def close(self):
+        self.stopped.set()
+        for t in self.threads:
+            t.join()
+
+        if self.listener:
+            self.listener.close()
+
+        with self.lock:
+            conns = list(self.conns.values())
+        for conn in conns:
+            _close(conn)
+
+    def _accept_loop(self):
+        while not self.stopped.is_set():
+            try:
+                conn, _ = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+
+            with self.lock:
+                wid = self.next_id
+                self.next_id += 1
+                self.conns[wid] = conn
+                self.last_seen[wid] = time.monotonic()
+
+            threading.Thread(target=self._handle, args=(wid, conn), daemon=True).start()
+
+    def _monitor_loop(self):
+        while not self.stopped.wait(self.heartbeat_timeout / 4):
+            now = time.monotonic()
+            with self.lock:
+                busy = set(self.assigned.values())
+                dead = [w for w in busy if now - self.last_seen[w] > self.heartbeat_timeout]
+
+            for wid in dead:
+                self._drop(wid)
+
+    def _drop(self, wid):
+        '''
+        Forget a worker and hand the items it held out again.
+        '''
+        with self.lock:
+            items = [k for k, v in self.assigned.items() if v == wid]
+            for item in items:
+                del self.assigned[item]
+            conn = self.conns.pop(wid, None)
+            self.last_seen.pop(wid, None)
+
+        for item in items:
+            self.wq.requeue(item)
+
+        if conn:
+            _close(conn)
+
+    def _release(self, name, wid):
+        '''
+        Returns whether name was still assigned to wid. It might not be if
+        the worker was dropped and the item handed to someone else.
+        '''
+        with self.lock:
+            if self.assigned.get(name) != wid:
+                return False
+            del self.assigned[name]
+            return True
+
+    def _handle(self, wid, conn):
+        try:
+            for line in conn.makefile("rb"):
+                msg = json.loads(line)
+                op = msg["op"]
+
+                with self.lock:
+                    if wid in self.last_seen:
+                        self.last_seen[wid] = time.monotonic()
+
+                if op == "get":
+                    try:
+                        item = self.wq.get_item(wait=True)
+                    except RuntimeError:
+                        item = None
+
+                    if item is None:
+                        _send(conn, {"op": "finished"})
+                        continue
+
+                    with self.lock:
+                        self.assigned[item] = wid
+                        self.last_seen[wid] = time.monotonic()
+                    _send(conn, {"op": "item", "name": item})
+
+                elif op == "heartbeat":
+                    pass
+
+                elif op == "done":
+                    if self._release(msg["name"], wid):
+                        try:
+                            self.wq.mark_done(msg["name"], ts=msg["ts"])
+                        except Exception:
+                            # e.g. the item is still older than its
+                            # predecessors
+                            self.wq.mark_error(msg["name"])
+                    _send(conn, {"op": "ack"})
+
+                elif op == "error":
+                    if self._release(msg["name"], wid):
+                        self.wq.mark_error(msg["name"])
+                    _send(conn, {"op": "ack"})
+
+                else:
+                    raise ValueError(f"Unknown message {op}")
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._drop(wid)
+
+
+def run_worker(address, run_item, heartbeat_interval=1.0):
+    '''
+    Connect to a Coordinator and build items until it has no more work.
+
+    `run_item(name)` builds an item and returns its new timestamp. If it
+    raises, the item is reported as failed.
+    '''
+    sock = _connect(address)
+    send_lock = threading.Lock()
+    stopped = threading.Event()
+
+    def send(msg):
+        with send_lock:
+            _send(sock, msg)
+
+    def heartbeat():
+        while not stopped.wait(heartbeat_interval):
+            try:
+                send({"op": "heartbeat"})
+            except OSError:
+                return
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    rfile = sock.makefile("rb")
+    try:
+        while True:
+            send({"op": "get"})
+            line = rfile.readline()
+            if not line:
+                return
+
+            reply = json.loads(line)
+            if reply["op"] == "finished":
+                return
+
+            name = reply["name"]
+            try:
+                ts = run_item(name)
+            except Exception:
+                send({"op": "error", "name": name})
+            else:
+                send({"op": "done", "name": name, "ts": ts})
+
+            if not rfile.readline():
+                return
+    finally:
+        stopped.set()
+        _close(sock)
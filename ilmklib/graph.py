@@ -1,21 +1,66 @@
 
+import math
 import random
 from collections.abc import Iterable
-from collections import deque
-from .unique_stack import UniqueStack
+from collections import Counter, deque
+from itertools import chain, islice
+from .unique_stack import IntUniqueStack
+from .metrics import metrics
+
+# Edge kinds. An order-only edge makes sure src is built before dst, but dst
+# isn't rebuilt just because src is newer (e.g. a directory dst is put in).
+NORMAL = "normal"
+ORDER_ONLY = "order_only"
 
 
 class Vertex:
 
-    def __init__(self, key, value):
+    def __init__(self, key, value, phony=False):
         self.key = key
         self.value = value
+        self.phony = phony
         self.successors = set()
         self.predecessors = set()
+        # Predecessors whose edge to this vertex is order-only
+        self.order_only = set()
 
-    def add_edge_to(self, other):
+    def add_edge_to(self, other, kind=NORMAL):
         self.successors.add(other.key)
         other.predecessors.add(self.key)
+        if kind == ORDER_ONLY:
+            other.order_only.add(self.key)
+        else:
+            other.order_only.discard(self.key)
+
+    def remove_edge_to(self, other):
+        self.successors.discard(other.key)
+        other.predecessors.discard(self.key)
+        other.order_only.discard(self.key)
+
+
+class Shard:
+    """
+    A part of a Graph, made by `Graph.partition`.
+
+    `graph` holds the shard's vertices and the edges between them. Edges
+    crossing to other shards are summarized in `incoming`, mapping a vertex of
+    the shard to its predecessors in other shards, and `outgoing`, mapping a
+    vertex to its successors in other shards. `order_only` holds the incoming
+    (dst, src) pairs that are order-only and `depends_on` the indices of the
+    shards with edges into this one.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.keys = []
+        self.graph = Graph()
+        self.incoming = {}
+        self.outgoing = {}
+        self.order_only = set()
+        self.depends_on = set()
+
+    def __len__(self):
+        return len(self.keys)
 
 
 class Graph:
@@ -27,6 +72,14 @@ class Graph:
         self.leaf_nodes = set()
         self.root_nodes = set()
 
+        # Maps each vertex made by a multi-output action to all of the
+        # vertices that action makes
+        self.groups = {}
+
+        # Reported by metrics for as long as the graph is alive
+        self.counters = {"graph_vertices": 0, "graph_edges": 0}
+        metrics.track(self, self.counters)
+
     def __len__(self):
         return len(self.vertices)
 
@@ -43,18 +96,26 @@ class Graph:
         for k, v in self.vertices.items():
             yield (k, v.value)
 
-    def add_vertex(self, key, value=None):
+    def add_vertex(self, key, value=None, phony=False):
+        '''
+        Add a vertex. A phony vertex is an alias for its predecessors (e.g.
+        "all"), it's never probed for a timestamp nor built.
+        '''
         if key in self.vertices:
             raise Exception(f"{key} already in graph")
 
-        self.vertices[key] = Vertex(key, value)
+        self.vertices[key] = Vertex(key, value, phony)
         self.leaf_nodes.add(key)
         self.root_nodes.add(key)
+        self.counters["graph_vertices"] += 1
 
-    def add_edge(self, dst, *srcs):
+    def add_edge(self, dst, *srcs, kind=NORMAL):
         if dst not in self.vertices:
             raise Exception(f"{dst} not present in graph.")
 
+        if not kind in (NORMAL, ORDER_ONLY):
+            raise ValueError(f"Unknown edge kind {kind}")
+
         for src in srcs:
 
             if src not in self.vertices:
@@ -63,24 +124,117 @@ class Graph:
             # TODO: Change this to allow variadic sources
             if src == dst:
                 self.direct_cyclic = True
+            elif self.groups and src in self.groups.get(dst, ()):
+                raise Exception(f"{src} and {dst} are made by the same action.")
+
+            if not dst in self.vertices[src].successors:
+                self.counters["graph_edges"] += 1
 
-            self.vertices[src].add_edge_to(self.vertices[dst])
+            self.vertices[src].add_edge_to(self.vertices[dst], kind)
             self.leaf_nodes.discard(dst)
             self.root_nodes.discard(src)
 
-    def add_edges(self, dst, src_list):
+    def remove_edge(self, dst, *srcs):
+        if dst not in self.vertices:
+            raise Exception(f"{dst} not present in graph.")
+
+        for src in srcs:
+
+            if src not in self.vertices:
+                raise Exception(f"{src} not present in graph.")
+
+            if not dst in self.vertices[src].successors:
+                raise Exception(f"No edge from {src} to {dst}.")
+
+            self.vertices[src].remove_edge_to(self.vertices[dst])
+            self.counters["graph_edges"] -= 1
+            if not self.vertices[dst].predecessors:
+                self.leaf_nodes.add(dst)
+            if not self.vertices[src].successors:
+                self.root_nodes.add(src)
+
+            if src == dst:
+                self._update_direct_cyclic()
+
+    def remove_vertex(self, key):
+        if key not in self.vertices:
+            raise Exception(f"{key} not present in graph.")
+
+        v = self.vertices[key]
+        self.remove_edge(key, *list(v.predecessors))
+        for succ in list(v.successors):
+            self.remove_edge(succ, key)
+
+        if key in self.groups:
+            group = tuple(x for x in self.groups.pop(key) if x != key)
+            for k in group:
+                self.groups[k] = group
+
+        del self.vertices[key]
+        self.leaf_nodes.discard(key)
+        self.root_nodes.discard(key)
+        self.counters["graph_vertices"] -= 1
+
+    def replace_predecessors(self, key, new_set):
+        '''
+        Replace the direct predecessors of key with new_set, only touching the
+        edges that actually changed.
+        '''
+        if key not in self.vertices:
+            raise Exception(f"{key} not present in graph.")
+
+        new_set = set(new_set)
+        for src in new_set:
+            if src not in self.vertices:
+                raise Exception(f"{src} not present in graph.")
+
+        old_set = self.vertices[key].predecessors
+        self.remove_edge(key, *(old_set - new_set))
+        self.add_edge(key, *(new_set - old_set))
+
+    def add_group(self, *keys):
+        '''
+        Declare that keys are all made by a single action, e.g. a code
+        generator writing several files. A WorkQueue hands the group out once.
+        There can't be edges between the members of a group.
+        '''
+        for key in keys:
+            if key not in self.vertices:
+                raise Exception(f"{key} not present in graph.")
+            if key in self.groups:
+                raise Exception(f"{key} is already in a group.")
+
+        for key in keys:
+            for succ in self.vertices[key].successors:
+                if succ != key and succ in keys:
+                    raise Exception(f"{succ} depends on {key}, which is made by the same action.")
+
+        group = tuple(keys)
+        for key in group:
+            self.groups[key] = group
+
+    def _update_direct_cyclic(self):
+        self.direct_cyclic = any(k in v.successors for k, v in self.vertices.items())
+
+    def add_edges(self, dst, src_list, kind=NORMAL):
 
         if not type(src_list) is list:
             raise TypeError("Add edges must be passed a list")
 
         for src in src_list:
             # TODO: Change this function to only take lists.
-            self.add_edge(dst, src)
+            self.add_edge(dst, src, kind=kind)
+
+    def is_phony(self, key):
+        return self.vertices[key].phony
+
+    def is_order_only(self, dst, src):
+        return src in self.vertices[dst].order_only
 
 
     def get_all_successors(self, key):
 
-        seen = set(key)
+        seen = {key}
 
         stack = deque(self.get_direct_successors(key))
 
@@ -104,7 +258,7 @@ class Graph:
 
     def get_all_predecessors(self, key):
 
-        seen = set(key)
+        seen = {key}
 
         stack = deque(self.get_direct_predecessors(key))
 
@@ -117,50 +271,72 @@ class Graph:
                 stack.extend(self.get_direct_predecessors(elem))
                 yield elem
 
+    def weakly_connected_components(self):
+        '''
+        Sets of vertices connected to each other when edge directions are
+        ignored.
+        '''
+        seen = set()
+        components = []
+        for key in self.vertices:
+            if key in seen:
+                continue
+
+            seen.add(key)
+            component = {key}
+            stack = [key]
+            while stack:
+                v = self.vertices[stack.pop()]
+                for w in v.successors | v.predecessors:
+                    if not w in seen:
+                        seen.add(w)
+                        component.add(w)
+                        stack.append(w)
+
+            components.append(component)
+
+        return components
+
     def tarjans(self, use_rng=False):
 
-        node_st = {}
-        idx = 0
-        stack = UniqueStack()
+        # Vertices are numbered in the order they're visited, so the stack and
+        # the low links can be indexed by that number. keys maps it back to
+        # the vertex.
+        index = {}
+        lowlink = []
+        keys = []
+        stack = IntUniqueStack(size=len(self.vertices))
+        # Checked directly rather than through `in`, this is the inner loop
+        positions = stack.positions
         scc_list = []
 
         def strongconnect(v):
-            nonlocal node_st
-            nonlocal idx
-            nonlocal stack
-            nonlocal scc_list
-            node_st[v] = (idx, idx)
-            idx += 1
-            stack.push(v)
+            v_idx = len(keys)
+            index[v] = v_idx
+            lowlink.append(v_idx)
+            keys.append(v)
+            stack.push(v_idx)
 
             for w in self.vertices[v].successors:
-                if not w in node_st:
-                    strongconnect(w)
-                    v_idx, v_ll = node_st[v]
-                    w_idx, w_ll = node_st[w]
-                    node_st[v] = (v_idx, min(v_ll, w_ll))
-                else:
-                    if w in stack:
-                        v_idx, v_ll = node_st[v]
-                        w_idx, w_ll = node_st[w]
-                        node_st[v] = (v_idx, min(v_ll, w_idx))
-
-            v_idx, v_ll = node_st[v]
-            if v_idx == v_ll:
-                scc = []
-                while True:
-                    w = stack.pop()
-                    scc.append(w)
-                    if w == v:
-                        break
-                scc_list.append(scc)
+                w_idx = index.get(w)
+                if w_idx is None:
+                    w_idx = strongconnect(w)
+                    lowlink[v_idx] = min(lowlink[v_idx], lowlink[w_idx])
+                elif positions[w_idx] != -1:
+                    lowlink[v_idx] = min(lowlink[v_idx], w_idx)
+
+            if lowlink[v_idx] == v_idx:
+                scc = stack.pop_until(v_idx)
+                scc_list.append([keys[i] for i in reversed(scc)] if len(scc) > 1 else [v])
+
+            return v_idx
 
         elems = list(self.vertices.keys())
         if use_rng:
             random.shuffle(elems)
 
         for e in elems:
-            if not e in node_st:
+            if not e in index:
                 strongconnect(e)
 
         return scc_list
@@ -174,3 +350,140 @@ class Graph:
         return len(self.tarjans(use_rng)) != len(self.vertices)
 
 
+
+    def _order(self, component):
+        '''
+        The vertices of component in reverse DFS postorder. That's a
+        topological order if there are no cycles, and it keeps chains of
+        vertices next to each other.
+        '''
+        starts = chain((k for k in component if not self.vertices[k].predecessors), component)
+        seen = set()
+        post = []
+        for start in starts:
+            if start in seen:
+                continue
+
+            seen.add(start)
+            stack = [(start, iter(self.vertices[start].successors))]
+            while stack:
+                v, it = stack[-1]
+                for w in it:
+                    if not w in seen:
+                        seen.add(w)
+                        stack.append((w, iter(self.vertices[w].successors)))
+                        break
+                else:
+                    stack.pop()
+                    post.append(v)
+
+        post.reverse()
+        return post
+
+    def _backward_edges(self, key, shard, shard_of):
+        v = self.vertices[key]
+        return (sum(shard_of[x] > shard for x in v.predecessors if x != key)
+                + sum(shard_of[x] < shard for x in v.successors if x != key))
+
+    def partition(self, parts, slack=0.05, passes=2):
+        '''
+        Split the graph into `parts` Shards of about the same size with few
+        edges between them.
+
+        Weakly connected components are kept whole where they fit. Larger
+        ones are cut along a topological order and spread over the shards in
+        index order, so that edges between shards of a DAG only point to
+        later shards. Then, for up to `passes` passes, vertices on the border
+        move to the neighbouring shard holding most of their edges, as long
+        as no shard grows more than `slack` beyond an even share and no edge
+        starts pointing backwards.
+        '''
+        if parts < 1:
+            raise ValueError("Need at least one part")
+
+        n = len(self.vertices)
+        target = max(1, math.ceil(n / parts))
+
+        comp_of = {}
+        for i, component in enumerate(self.weakly_connected_components()):
+            for key in component:
+                comp_of[key] = i
+        components = {}
+        for key in self.vertices:
+            components.setdefault(comp_of[key], []).append(key)
+
+        shard_of = {}
+        loads = [0] * parts
+        for component in sorted(components.values(), key=len, reverse=True):
+            i = min(range(parts), key=loads.__getitem__)
+            if loads[i] + len(component) <= target:
+                for key in component:
+                    shard_of[key] = i
+                loads[i] += len(component)
+                continue
+
+            # Doesn't fit anywhere, fill the room left in the shards in order
+            order = iter(self._order(component))
+            for i in range(parts):
+                for key in islice(order, target - loads[i]):
+                    shard_of[key] = i
+                    loads[i] += 1
+
+        high = n / parts * (1 + slack)
+        low = n / parts * (1 - slack)
+        for _ in range(passes):
+            moved = False
+            for key, v in self.vertices.items():
+                i = shard_of[key]
+                counts = Counter(shard_of[x] for x in chain(v.predecessors, v.successors) if x != key)
+                if len(counts) - (i in counts) == 0:
+                    continue
+
+                best, best_gain = None, 0
+                backward = self._backward_edges(key, i, shard_of)
+                for j, count in counts.items():
+                    gain = count - counts.get(i, 0)
+                    if j == i or gain <= best_gain:
+                        continue
+                    if loads[j] + 1 > high or loads[i] - 1 < low:
+                        continue
+                    if self._backward_edges(key, j, shard_of) > backward:
+                        continue
+                    best, best_gain = j, gain
+
+                if best is not None:
+                    shard_of[key] = best
+                    loads[i] -= 1
+                    loads[best] += 1
+                    moved = True
+
+            if not moved:
+                break
+
+        shards = [Shard(i) for i in range(parts)]
+        for key, v in self.vertices.items():
+            shard = shards[shard_of[key]]
+            shard.keys.append(key)
+            shard.graph.add_vertex(key, v.value, v.phony)
+
+        for key, v in self.vertices.items():
+            shard = shards[shard_of[key]]
+            for succ in v.successors:
+                other = shards[shard_of[succ]]
+                kind = ORDER_ONLY if key in self.vertices[succ].order_only else NORMAL
+                if other is shard:
+                    shard.graph.add_edge(succ, key, kind=kind)
+                    continue
+
+                shard.outgoing.setdefault(key, set()).add(succ)
+                other.incoming.setdefault(succ, set()).add(key)
+                other.depends_on.add(shard.index)
+                if kind == ORDER_ONLY:
+                    other.order_only.add((succ, key))
+
+        for key, members in self.groups.items():
+            shard = shards[shard_of[key]]
+            if key == members[0] and all(shard_of[x] == shard.index for x in members):
+                shard.graph.add_group(*members)
+
+        return shards
@@ -0,0 +1,177 @@
+
+import os
+import re
+import select
+import shutil
+import tempfile
+import threading
+
+auth_re = re.compile(r"--jobserver-(?:auth|fds)=(\S+)")
+
+
+def _nonblocking(fd):
+    '''
+    A non-blocking descriptor for the pipe behind fd. Setting O_NONBLOCK on
+    fd itself would change it for every process sharing the pipe, so it's
+    reopened through /proc, which gives it its own open file description.
+    '''
+    if not os.get_blocking(fd):
+        return os.dup(fd)
+
+    try:
+        return os.open(f"/proc/self/fd/{fd}", os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        # No /proc, settle for changing the shared flag
+        fd = os.dup(fd)
+        os.set_blocking(fd, False)
+        return fd
+
+
+class JobserverClient:
+    """
+    Take job tokens from a GNU make jobserver.
+
+    Like every make child, the process owns one implicit token, so the first
+    job never has to wait. Every job after that reads a token from the
+    jobserver before it runs and writes it back when it's finished.
+    """
+
+    def __init__(self, read_fd, write_fd):
+        # Another process can take the token between select() and read(), so
+        # reads must not block
+        self.read_fd = _nonblocking(read_fd)
+        self.write_fd = write_fd
+
+        self.lock = threading.Lock()
+        self.implicit_used = False
+        self.tokens = []
+
+    @classmethod
+    def from_environ(cls, environ=None):
+        '''
+        Connect to the jobserver described in MAKEFLAGS. Returns None if
+        there isn't one, or if its file descriptors weren't passed down to
+        this process (make only does that for recipes marked with `+`).
+        '''
+        if environ is None:
+            environ = os.environ
+
+        auths = auth_re.findall(environ.get("MAKEFLAGS", ""))
+        if not auths:
+            return None
+
+        auth = auths[-1]
+        try:
+            if auth.startswith("fifo:"):
+                path = auth[len("fifo:"):]
+                r = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+                w = os.open(path, os.O_WRONLY)
+            else:
+                r, w = (int(x) for x in auth.split(","))
+                os.fstat(r)
+                os.fstat(w)
+        except (OSError, ValueError):
+            return None
+
+        client = cls(r, w)
+        if auth.startswith("fifo:"):
+            # The client has its own copy
+            os.close(r)
+        return client
+
+    def acquire(self, block=True):
+        '''
+        Take a token. Returns False if block is False and none is free.
+        '''
+        with self.lock:
+            if not self.implicit_used:
+                self.implicit_used = True
+                return True
+
+        while True:
+            r, _, _ = select.select([self.read_fd], [], [], None if block else 0)
+            if not r:
+                return False
+
+            try:
+                token = os.read(self.read_fd, 1)
+            except BlockingIOError:
+                # Someone else got to it first
+                continue
+
+            if not token:
+                raise RuntimeError("The jobserver went away")
+
+            with self.lock:
+                self.tokens.append(token)
+            return True
+
+    def release(self):
+        with self.lock:
+            if self.tokens:
+                os.write(self.write_fd, self.tokens.pop())
+            else:
+                self.implicit_used = False
+
+    def close(self):
+        os.close(self.read_fd)
+
+
+class JobserverServer:
+    """
+    Be the jobserver for child processes (sub-makes, or other scripts using
+    JobserverClient), so that at most `jobs` jobs run across all of them.
+
+    Start children with `env()` as their environment. With style="pipe",
+    which every GNU make understands, they must also be given `pass_fds`.
+    style="fifo" needs GNU make 4.4 or newer but no file descriptors.
+    """
+
+    def __init__(self, jobs, style="pipe"):
+
+        self.jobs = jobs
+        self.style = style
+        self.tmpdir = None
+
+        if style == "pipe":
+            self.read_fd, self.write_fd = os.pipe()
+            self.pass_fds = (self.read_fd, self.write_fd)
+            self.auth = f"{self.read_fd},{self.write_fd}"
+        elif style == "fifo":
+            self.tmpdir = tempfile.mkdtemp(prefix="ilmklib-jobserver-")
+            self.path = os.path.join(self.tmpdir, "fifo")
+            os.mkfifo(self.path)
+            self.read_fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+            self.write_fd = os.open(self.path, os.O_WRONLY)
+            self.pass_fds = ()
+            self.auth = f"fifo:{self.path}"
+        else:
+            raise ValueError(f"Unknown jobserver style {style}")
+
+        # Our own implicit token is the one not in the pipe
+        os.write(self.write_fd, b"+" * (jobs - 1))
+
+    def makeflags(self):
+        return f"-j{self.jobs} --jobserver-auth={self.auth}"
+
+    def env(self, environ=None):
+        if environ is None:
+            environ = os.environ
+
+        env = dict(environ)
+        old = auth_re.sub("", env.get("MAKEFLAGS", ""))
+        old = re.sub(r"(^|\s)-j\d*", " ", old).strip()
+        env["MAKEFLAGS"] = f"{old} {self.makeflags()}".strip()
+        return env
+
+    def client(self):
+        '''
+        A client for this process's own jobs, sharing the children's tokens.
+        '''
+        return JobserverClient(self.read_fd, self.write_fd)
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir)
@@ -0,0 +1,148 @@
+
+import itertools
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Counters for the build engine. They are always on and cheap to update.
+
+    Names ending in `_total` are counters, anything else is a gauge that can
+    go up and down (e.g. the number of vertices in all graphs).
+
+    Every thread counts into its own dict, so updating a counter takes no
+    lock. Objects on a hot path, like a WorkQueue, keep their own counters
+    instead and register them with `track`. `as_dict` adds them all up.
+    """
+
+    def __init__(self):
+        # Only taken to register and combine counters, never to update them
+        self.lock = threading.Lock()
+        self.keys = itertools.count()
+        self.tracked = {}
+        # Keys of tracked objects that are gone. Their finalizers can run
+        # from the garbage collector at any allocation, even on a thread
+        # holding self.lock, so they only append here and the counters are
+        # folded into self.retired later.
+        self.retiring = deque()
+        # Counters of tracked objects and threads that are gone
+        self.retired = {}
+        self.local = threading.local()
+        # (thread, counters) for every live thread that has counted something
+        self.thread_counters = []
+        self.start = time.monotonic()
+
+    def _counters(self):
+        try:
+            return self.local.counters
+        except AttributeError:
+            c = self.local.counters = {}
+            with self.lock:
+                self._fold()
+                self.thread_counters.append((threading.current_thread(), c))
+            return c
+
+    def track(self, owner, counters):
+        '''
+        Include `counters`, a dict that owner updates itself (e.g. under its
+        own lock), in `as_dict`. Its gauges go away with owner, its counters
+        are kept.
+        '''
+        key = next(self.keys)
+        with self.lock:
+            self.tracked[key] = counters
+        weakref.finalize(owner, self.retiring.append, key)
+
+    def _retire(self, counters):
+        for name, value in counters.items():
+            if name.endswith("_total"):
+                self.retired[name] = self.retired.get(name, 0) + value
+
+    def _fold(self):
+        '''
+        Move the counters of objects and threads that are gone to
+        self.retired. Must be called with self.lock held.
+        '''
+        while self.retiring:
+            self._retire(self.tracked.pop(self.retiring.popleft()))
+
+        alive = []
+        for t, c in self.thread_counters:
+            if t.is_alive():
+                alive.append((t, c))
+            else:
+                self._retire(c)
+        self.thread_counters = alive
+
+    def inc(self, name, value=1):
+        c = self._counters()
+        c[name] = c.get(name, 0) + value
+
+    def dec(self, name, value=1):
+        self.inc(name, -value)
+
+    def observe(self, name, seconds):
+        '''
+        Count one call to `<name>_total` that took `seconds` to
+        `<name>_seconds_total`.
+        '''
+        c = self._counters()
+        c[name + "_total"] = c.get(name + "_total", 0) + 1
+        c[name + "_seconds_total"] = c.get(name + "_seconds_total", 0) + seconds
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def reset(self):
+        '''
+        Zero the counters. Gauges describe live objects and are left alone.
+        '''
+        with self.lock:
+            self._fold()
+            for _, c in self.thread_counters:
+                c.clear()
+            for c in self.tracked.values():
+                for name in [x for x in c if x.endswith("_total")]:
+                    c[name] = 0
+            self.retired.clear()
+            self.start = time.monotonic()
+
+    def as_dict(self):
+        with self.lock:
+            self._fold()
+            sources = [c for _, c in self.thread_counters]
+            sources += list(self.tracked.values())
+            sources.append(dict(self.retired))
+
+        o = {}
+        for c in sources:
+            # Copying a dict is atomic, even while its owner updates it
+            for name, value in c.copy().items():
+                o[name] = o.get(name, 0) + value
+        elapsed = time.monotonic() - self.start
+
+        if elapsed > 0:
+            o["workqueue_items_per_second"] = o.get("workqueue_items_done_total", 0) / elapsed
+
+        return o
+
+    def to_prometheus(self, prefix="ilmklib_"):
+        lines = []
+        for name, value in sorted(self.as_dict().items()):
+            kind = "counter" if name.endswith("_total") else "gauge"
+            lines.append(f"# TYPE {prefix}{name} {kind}")
+            lines.append(f"{prefix}{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
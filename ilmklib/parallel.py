@@ -0,0 +1,138 @@
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import chain
+
+from .graph import Graph, NORMAL, ORDER_ONLY
+from .work_queue import WorkQueue
+
+
+def _tarjans(g):
+    return g.tarjans()
+
+
+def _is_cyclic(g):
+    return g.is_cyclic()
+
+
+def _analyze(g, keys, ts_rule_dict, boundary, edges):
+    # The predecessors in other shards are already evaluated, so the queue
+    # takes their state as it is instead of probing them
+    for src in boundary:
+        g.add_vertex(src)
+    for dst, src, kind in edges:
+        g.add_edge(dst, src, kind=kind)
+
+    wq = WorkQueue(g, ts_rule_dict)
+    for src, (ts, ood) in boundary.items():
+        wq.timestamps[src] = ts
+        if ood:
+            wq.out_of_date.add(src)
+        else:
+            wq.in_date.add(src)
+
+    for key in keys:
+        wq.activate(key)
+
+    return ({k: wq.timestamps[k] for k in keys},
+            {k for k in keys if k in wq.out_of_date})
+
+
+def _shards_cyclic(shards):
+    g = Graph()
+    for shard in shards:
+        g.add_vertex(shard.index)
+    for shard in shards:
+        g.add_edge(shard.index, *shard.depends_on)
+    return g.is_cyclic()
+
+
+def parallel_tarjans(shards, processes=None):
+    '''
+    Strongly connected components of the graph split into `shards` by
+    `Graph.partition`, found for each shard in its own process.
+
+    If the shards depend on each other in a cycle, a component may span
+    several of them. The per-shard components are then merged over the
+    edges between them, which is done in this process.
+    '''
+    with ProcessPoolExecutor(max_workers=processes) as ex:
+        results = list(ex.map(_tarjans, [s.graph for s in shards]))
+
+    if not _shards_cyclic(shards):
+        return [scc for sccs in results for scc in sccs]
+
+    scc_of = {}
+    c = Graph()
+    for i, sccs in enumerate(results):
+        for j, scc in enumerate(sccs):
+            c.add_vertex((i, j))
+            for key in scc:
+                scc_of[key] = (i, j)
+
+    for shard in shards:
+        for key, v in shard.graph.vertices.items():
+            for succ in chain(v.successors, shard.outgoing.get(key, ())):
+                if scc_of[key] != scc_of[succ]:
+                    c.add_edge(scc_of[succ], scc_of[key])
+
+    return [[key for i, j in scc for key in results[i][j]] for scc in c.tarjans()]
+
+
+def parallel_is_cyclic(shards, processes=None):
+    '''
+    Whether the graph split into `shards` has a cycle, checked for each
+    shard in its own process.
+    '''
+    with ProcessPoolExecutor(max_workers=processes) as ex:
+        if any(ex.map(_is_cyclic, [s.graph for s in shards])):
+            return True
+
+    if not _shards_cyclic(shards):
+        return False
+
+    return any(len(scc) > 1 for scc in parallel_tarjans(shards, processes))
+
+
+def parallel_analyze(shards, ts_rule_dict, processes=None):
+    '''
+    Evaluate every item of the graph split into `shards` like
+    `WorkQueue.activate` does, each shard in its own process. A shard is
+    started once the shards it depends on are done, so the timestamp rules
+    are still called once per item. Returns the timestamps and the set of
+    out-of-date items.
+
+    The timestamp rules must be picklable, e.g. module level functions.
+    '''
+    if _shards_cyclic(shards):
+        raise Exception("Shards depend on each other in a cycle")
+
+    timestamps = {}
+    out_of_date = set()
+
+    pending = list(shards)
+    running = {}
+    done = set()
+    with ProcessPoolExecutor(max_workers=processes) as ex:
+        while pending or running:
+            for shard in [s for s in pending if s.depends_on <= done]:
+                pending.remove(shard)
+
+                boundary = {}
+                edges = []
+                for dst, srcs in shard.incoming.items():
+                    for src in srcs:
+                        boundary[src] = (timestamps[src], src in out_of_date)
+                        kind = ORDER_ONLY if (dst, src) in shard.order_only else NORMAL
+                        edges.append((dst, src, kind))
+
+                f = ex.submit(_analyze, shard.graph, shard.keys, ts_rule_dict, boundary, edges)
+                running[f] = shard.index
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for f in finished:
+                done.add(running.pop(f))
+                ts, ood = f.result()
+                timestamps.update(ts)
+                out_of_date |= ood
+
+    return timestamps, out_of_date
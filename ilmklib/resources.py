@@ -0,0 +1,99 @@
+
+import os
+import time
+
+
+def _available_memory():
+    '''
+    MemAvailable from /proc/meminfo in MiB, or None where it isn't available.
+    '''
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class ResourcePool:
+    """
+    Limit how many items of each rule type a WorkQueue hands out at once.
+
+    `requirements` is keyed the same way as the timestamp rules and maps a
+    rule type to the resources one of its items holds while it runs, e.g.
+    `{"link": {"memory": 4096, "cpu": 1, "link": 1}}`. Types that aren't
+    listed need nothing. `limits` gives the total of each resource, e.g.
+    `{"memory": 16384, "cpu": 8, "link": 4}`; resources without a limit are
+    unbounded.
+
+    With `adaptive=True` the "cpu" limit is lowered by the load that other
+    processes put on the machine (from the load average) and the "memory"
+    limit (in MiB) by the memory that isn't available, re-read at most every
+    `interval` seconds.
+
+    An item is always allowed to run when nothing else is running, so an item
+    that needs more than a limit doesn't block the build forever.
+    """
+
+    def __init__(self, requirements, limits, adaptive=False, interval=1.0):
+
+        self.requirements = requirements
+        self.limits = dict(limits)
+        self.adaptive = adaptive
+        self.interval = interval
+
+        self.in_use = {}
+        self.running = 0
+
+        self.effective = dict(self.limits)
+        self.refreshed = None
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self.refreshed is not None and now - self.refreshed < self.interval:
+            return
+        self.refreshed = now
+
+        self.effective = dict(self.limits)
+
+        if "cpu" in self.limits:
+            # The load average counts our own jobs as well
+            load = os.getloadavg()[0] - self.in_use.get("cpu", 0)
+            free = os.cpu_count() - max(load, 0)
+            self.effective["cpu"] = min(self.limits["cpu"], max(free, 1))
+
+        if "memory" in self.limits:
+            avail = _available_memory()
+            if avail is not None:
+                free = self.in_use.get("memory", 0) + avail
+                self.effective["memory"] = min(self.limits["memory"], free)
+
+    def fits(self, item_type):
+        if self.running == 0:
+            return True
+
+        req = self.requirements.get(item_type)
+        if not req:
+            return True
+
+        if self.adaptive:
+            self._refresh()
+
+        for name, amount in req.items():
+            limit = self.effective.get(name)
+            if limit is not None and self.in_use.get(name, 0) + amount > limit:
+                return False
+
+        return True
+
+    def acquire(self, item_type):
+        self.running += 1
+        for name, amount in self.requirements.get(item_type, {}).items():
+            self.in_use[name] = self.in_use.get(name, 0) + amount
+
+    def release(self, item_type):
+        self.running -= 1
+        for name, amount in self.requirements.get(item_type, {}).items():
+            self.in_use[name] -= amount
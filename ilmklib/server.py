@@ -0,0 +1,189 @@
+
+import os
+import socket
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .work_queue import WorkQueue
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            words = line.decode().split()
+            if not words:
+                continue
+
+            cmd, args = words[0], words[1:]
+            if cmd == "build" and len(args) == 1:
+                try:
+                    self.server.build_server.build(args[0])
+                    reply = "ok"
+                except Exception as e:
+                    reply = f"error {e}"
+            elif cmd == "quit":
+                self.wfile.write(b"ok\n")
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            else:
+                reply = f"error unknown request {line.decode().strip()}"
+
+            self.wfile.write(f"{reply}\n".encode())
+
+
+class BuildServer:
+    """
+    Keep a Graph and its timestamp rules in memory and answer build requests
+    over a local Unix socket.
+
+    Files are watched by polling their modification times. When a watched
+    file changes, `on_change(key)` is called (if given) before the next
+    build, which is the place to refresh dependencies with e.g.
+    `Graph.replace_predecessors`.
+
+    The protocol is line based. A client sends `build <target>` and gets back
+    `ok` or `error <message>`. Sending `quit` stops the server.
+    """
+
+    def __init__(self, graph, ts_rules, run_item, socket_path, watch=None,
+                 on_change=None, poll_interval=1.0, jobs=1):
+
+        self.g = graph
+        self.ts_rules = ts_rules
+        self.run_item = run_item
+        self.socket_path = socket_path
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.jobs = jobs
+
+        # Maps a watched path to the key of its vertex in the graph
+        if watch is None:
+            watch = {}
+        elif not isinstance(watch, dict):
+            watch = {x: x for x in watch}
+        self.watch = watch
+
+        self.lock = threading.Lock()
+        self.mtimes = {p: self._mtime(p) for p in self.watch}
+        self.dirty = set()
+        self.stopped = threading.Event()
+
+        self.server = None
+
+        # The queue is reused across requests so that only files that changed
+        # since the last build, and what depends on them, are probed again.
+        self.wq = WorkQueue(self.g, self.ts_rules)
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def poll(self):
+        '''
+        Check every watched path once and record the keys that changed.
+        '''
+        changed = set()
+        for path, key in self.watch.items():
+            m = self._mtime(path)
+            if m != self.mtimes[path]:
+                self.mtimes[path] = m
+                changed.add(key)
+
+        with self.lock:
+            self.dirty.update(changed)
+
+        return changed
+
+    def _poll_loop(self):
+        while not self.stopped.wait(self.poll_interval):
+            self.poll()
+
+    def _take_dirty(self):
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = set()
+        return dirty
+
+    def _run(self, wq, errors):
+        while True:
+            item = wq.get_item(wait=True)
+            if item is None:
+                return
+            try:
+                self.run_item(item)
+            except Exception as e:
+                # Recorded before the other workers see the error, which they
+                # only get as a bare RuntimeError
+                errors.append(e)
+                wq.mark_error(item)
+                raise
+            wq.mark_done(item)
+
+    def build(self, target):
+        '''
+        Bring target up to date. Only files reported changed by `poll` are
+        probed again, the rest of the analysis is kept from earlier builds.
+        '''
+        if target not in self.g:
+            raise KeyError(f"{target} not present in graph.")
+
+        dirty = self._take_dirty()
+        for key in dirty:
+            if self.on_change:
+                self.on_change(key)
+
+        wq = self.wq
+        if wq.error:
+            wq.reset()
+        else:
+            wq.invalidate(*dirty)
+        wq.activate(target)
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as ex:
+            futures = [ex.submit(self._run, wq, errors) for _ in range(self.jobs)]
+
+        errors.extend(f.exception() for f in futures if f.exception())
+        if errors:
+            raise errors[0]
+        if wq.error:
+            raise RuntimeError(f"Building {target} failed")
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        self.server = socketserver.UnixStreamServer(self.socket_path, _RequestHandler)
+        self.server.build_server = self
+
+        poller = threading.Thread(target=self._poll_loop, daemon=True)
+        poller.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.stopped.set()
+            poller.join()
+            self.server.server_close()
+            os.unlink(self.socket_path)
+
+    def shutdown(self):
+        self.stopped.set()
+        if self.server:
+            self.server.shutdown()
+
+
+def request(socket_path, line):
+    '''
+    Send a single request line to a BuildServer and return its reply.
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall(f"{line}\n".encode())
+        s.shutdown(socket.SHUT_WR)
+        with s.makefile() as f:
+            return f.readline().strip()
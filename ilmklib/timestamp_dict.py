@@ -3,8 +3,12 @@ import time
 
 import os
 import shutil
+import sqlite3
+import threading
 import os.path
 
+from .metrics import metrics
+
 class TimestampDict:
 
     def __init__(self, p_id=None):
@@ -43,6 +47,7 @@ class TimestampDict:
                 t = f.read().rstrip()
                 self.lookup[fname] = t
                 self.timestamps[fname] = os.path.getmtime(fpath)
+                metrics.inc("timestamp_dict_keys_loaded_total")
 
     def loadkey(self, dirname, key):
         pk = self.process_key(key)
@@ -62,6 +67,10 @@ class TimestampDict:
 
     def __getitem__(self, key):
         pk = self.process_key(key)
+        if pk in self.lookup:
+            metrics.inc("timestamp_dict_hits_total")
+        else:
+            metrics.inc("timestamp_dict_misses_total")
         return self.lookup[pk]
 
     def __setitem__(self, key, value):
@@ -131,3 +140,231 @@ class TimestampDict:
                 f.write(v)
     """
 
+
+
+class SharedTimestampDict(TimestampDict):
+    """
+    A TimestampDict kept in an SQLite file, so that several processes, e.g.
+    the workers of a process pool driving a WorkQueue, can share it.
+
+    The file is in WAL mode, so readers never block and aren't blocked by a
+    writer. Writes are buffered and committed together by `flush`, which
+    happens once `batch_size` of them are pending, before `time` or iterating
+    needs them and on `close`. Until then only this process sees them.
+
+    Timestamps are handed out when writes are committed, from a clock kept in
+    the file, so they keep increasing across processes even if their clocks
+    disagree a little.
+    """
+
+    def __init__(self, path, p_id=None, batch_size=64):
+        if not p_id:
+            p_id = ""
+
+        self.m_id = p_id
+        self.m_full_prefix = f"tsd::{self.m_id}/"
+        self.path = path
+        self.batch_size = batch_size
+
+        # Guards pending and flushing only, held briefly
+        self.lock = threading.Lock()
+        # key -> (value, timestamp), a value of None is a delete
+        self.pending = {}
+        # The batch being committed, still visible to this process's reads
+        self.flushing = {}
+
+        # Serializes writes, which can wait for another process's writer.
+        # Reads never take it.
+        self.write_lock = threading.Lock()
+        self.writer = None
+        self.writer_pid = None
+        # Every thread reads through its own connection
+        self.local = threading.local()
+
+        conn = self._writer()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS entries (tsd TEXT, key TEXT, value TEXT NOT NULL, ts REAL NOT NULL, PRIMARY KEY (tsd, key))")
+        conn.execute("CREATE TABLE IF NOT EXISTS clock (id INTEGER PRIMARY KEY CHECK (id = 0), ts REAL NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO clock VALUES (0, 0)")
+
+    def __getstate__(self):
+        # Pickled to be sent to another process, which opens its own
+        # connections
+        self.flush()
+        return {"path": self.path, "p_id": self.m_id, "batch_size": self.batch_size}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["p_id"], state["batch_size"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                               check_same_thread=False)
+
+    def _writer(self):
+        # Connections can't be shared with a forked child
+        if self.writer is None or self.writer_pid != os.getpid():
+            self.writer = self._connect()
+            self.writer_pid = os.getpid()
+        return self.writer
+
+    def _reader(self):
+        pid, conn = getattr(self.local, "reader", (None, None))
+        if pid != os.getpid():
+            conn = self._connect()
+            self.local.reader = (os.getpid(), conn)
+        return conn
+
+    def _query(self, sql, *args):
+        return self._reader().execute(sql, (self.m_id,) + args).fetchall()
+
+    def _write(self, pk, value, ts=None):
+        with self.lock:
+            # Keep the pending writes in the order they were made
+            self.pending.pop(pk, None)
+            self.pending[pk] = (value, ts)
+            full = len(self.pending) >= self.batch_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        '''
+        Commit the pending writes. Returns once everything written before
+        the call is committed, also by other threads.
+        '''
+        with self.write_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+                batch = self.flushing = self.pending
+                self.pending = {}
+
+            try:
+                self._commit(batch)
+            except BaseException:
+                with self.lock:
+                    # Try again with the next flush, unless written since
+                    for pk, entry in batch.items():
+                        self.pending.setdefault(pk, entry)
+                    self.flushing = {}
+                raise
+
+            with self.lock:
+                self.flushing = {}
+
+        metrics.inc("timestamp_dict_flushes_total")
+
+    def _commit(self, batch):
+        conn = self._writer()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            last = conn.execute("SELECT ts FROM clock").fetchone()[0]
+            for pk, (value, ts) in batch.items():
+                if value is None:
+                    conn.execute("DELETE FROM entries WHERE tsd = ? AND key = ?", (self.m_id, pk))
+                    continue
+
+                if ts is None:
+                    ts = max(time.time(), last + 1e-6)
+                last = max(last, ts)
+                conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                             (self.m_id, pk, value, ts))
+
+            conn.execute("UPDATE clock SET ts = ?", (last,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        self.flush()
+        with self.write_lock:
+            if self.writer is not None and self.writer_pid == os.getpid():
+                self.writer.close()
+            self.writer = None
+
+        pid, conn = getattr(self.local, "reader", (None, None))
+        if pid == os.getpid():
+            conn.close()
+        self.local = threading.local()
+
+    def loadkeydir(self, dirname, overwrite=False):
+        for fname in os.listdir(dirname):
+            fpath = os.path.join(dirname, fname)
+            if fname in self and not overwrite:
+                continue
+
+            with open(fpath) as f:
+                t = f.read().rstrip()
+                self._write(fname, t, os.path.getmtime(fpath))
+                metrics.inc("timestamp_dict_keys_loaded_total")
+
+    def _pending(self, pk):
+        with self.lock:
+            return self.pending.get(pk) or self.flushing.get(pk)
+
+    def __contains__(self, key):
+        pk = self.process_key(key)
+        p = self._pending(pk)
+        if p:
+            return p[0] is not None
+        return bool(self._query("SELECT 1 FROM entries WHERE tsd = ? AND key = ?", pk))
+
+    def __getitem__(self, key):
+        pk = self.process_key(key)
+        p = self._pending(pk)
+        if p:
+            rows = [] if p[0] is None else [(p[0],)]
+        else:
+            rows = self._query("SELECT value FROM entries WHERE tsd = ? AND key = ?", pk)
+
+        if rows:
+            metrics.inc("timestamp_dict_hits_total")
+            return rows[0][0]
+
+        metrics.inc("timestamp_dict_misses_total")
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if not type(value) is str or not type(key) is str:
+            raise TypeError(f"Passed non-string value or key")
+        if key == "":
+            raise ValueError("Passed empty string as key")
+
+        self._write(self.process_key(key), value)
+
+    def __delitem__(self, key):
+        if not key in self:
+            raise KeyError(key)
+
+        self._write(self.process_key(key), None)
+
+    def items(self):
+        self.flush()
+        return self._query("SELECT key, value FROM entries WHERE tsd = ?")
+
+    def __iter__(self):
+        return iter(k for k, _ in self.items())
+
+    def clear(self):
+        with self.write_lock:
+            with self.lock:
+                self.pending.clear()
+            self._writer().execute("DELETE FROM entries WHERE tsd = ?", (self.m_id,))
+
+    def time(self, entry):
+        pk = self.process_key(entry)
+        if self._pending(pk):
+            # The timestamp is only known once it's committed
+            self.flush()
+
+        rows = self._query("SELECT ts FROM entries WHERE tsd = ? AND key = ?", pk)
+        if not rows:
+            raise KeyError(entry)
+        return rows[0][0]
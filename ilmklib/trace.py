@@ -0,0 +1,74 @@
+
+import json
+import threading
+import time
+
+
+class Tracer:
+    """
+    Record what a WorkQueue spends its time on and export it as a Chrome trace
+    (https://ui.perfetto.dev or chrome://tracing can open it).
+
+    Pass an instance as the `tracer` argument of WorkQueue. Items are traced
+    from `get_item` until `mark_done`/`mark_error`, on the thread that took
+    them. Timestamp probes and `activate` are traced as well.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.started = {}
+        self.tids = {}
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter_ns()
+
+    def now(self):
+        return time.perf_counter_ns()
+
+    def _tid(self):
+        ident = threading.get_ident()
+        tid = self.tids.get(ident)
+        if tid is None:
+            with self.lock:
+                tid = self.tids.setdefault(ident, len(self.tids))
+        return tid
+
+    def complete(self, name, cat, start, args=None):
+        '''
+        Record an event that began at `start` (from `now()`) and ends now.
+        '''
+        end = self.now()
+        ev = {
+            "name": str(name),
+            "cat": cat,
+            "ph": "X",
+            "ts": (start - self.t0) / 1000,
+            "dur": (end - start) / 1000,
+            "pid": 0,
+            "tid": self._tid(),
+        }
+        if args:
+            ev["args"] = args
+        self.events.append(ev)
+
+    def begin(self, name):
+        self.started[name] = self.now()
+
+    def end(self, name, cat="item", args=None):
+        start = self.started.pop(name, None)
+        if start is not None:
+            self.complete(name, cat, start, args)
+
+    def to_dict(self):
+        meta = [{
+            "name": "thread_name",
+            "ph": "M",
+            "pid": 0,
+            "tid": tid,
+            "args": {"name": f"worker {tid}"},
+        } for tid in self.tids.values()]
+
+        return {"traceEvents": meta + self.events, "displayTimeUnit": "ms"}
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
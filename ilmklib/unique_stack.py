@@ -1,3 +1,4 @@
+from array import array
 from collections import deque
 
 class UniqueStack:
@@ -46,3 +47,82 @@ class UniqueStack:
     def peek(self):
         return self.stack[-1]
 
+
+
+class IntUniqueStack:
+    """
+    A UniqueStack for dense, non-negative integer ids, e.g. vertices numbered
+    in the order they're visited. The stack is an array and each id's position
+    on it is kept in another array, so membership checks don't hash and
+    `pop_until` takes a whole slice off in one go.
+
+    Methods
+    -------
+
+    push
+
+    pop
+
+    pop_until
+
+    peek
+    """
+
+    __slots__ = ("stack", "positions")
+
+    def __init__(self, iterable=None, size=0):
+        self.stack = array("q")
+        # Position of each id on the stack, -1 if it isn't on it
+        self.positions = array("q", [-1]) * size
+        if iterable:
+            for item in iterable:
+                self.push(item)
+
+    def __len__(self):
+        return len(self.stack)
+
+    def __contains__(self, key):
+        return 0 <= key < len(self.positions) and self.positions[key] != -1
+
+    def pop(self):
+        to_return = self.stack.pop()
+        self.positions[to_return] = -1
+        return to_return
+
+    def pop_until(self, marker):
+        '''
+        Pop everything down to and including marker. Returns the popped ids in
+        the order they were pushed.
+        '''
+        positions = self.positions
+        start = positions[marker] if 0 <= marker < len(positions) else -1
+        if start == -1:
+            raise Exception(f"{marker} not on stack")
+
+        stack = self.stack
+        if start == len(stack) - 1:
+            # The common case of popping a single id, without slicing
+            positions[stack.pop()] = -1
+            return [marker]
+
+        popped = stack[start:]
+        del stack[start:]
+        for item in popped:
+            positions[item] = -1
+        return popped.tolist()
+
+    def push(self, item):
+        positions = self.positions
+        if not 0 <= item < len(positions):
+            if item < 0:
+                raise ValueError("Stack requires non-negative ids")
+            grow = max(item + 1 - len(positions), len(positions))
+            positions.extend(array("q", [-1]) * grow)
+        elif positions[item] != -1:
+            raise Exception("Stack requires unique elements")
+
+        positions[item] = len(self.stack)
+        self.stack.append(item)
+
+    def peek(self):
+        return self.stack[-1]
@@ -1,52 +1,89 @@
 #!/usr/bin/env python3
 
-from collections import deque
-from threading import Condition
+from collections import deque, Counter
+from threading import Condition, Lock
 from concurrent.futures import ThreadPoolExecutor
 import time
 import copy
 
-from .graph import Graph
+from .graph import Graph, NORMAL, ORDER_ONLY
+from .metrics import metrics
 
 class WorkQueue:
 
 
     def raises_on_error(func):
         def error_check(self, *args, **kwargs):
-            with self.cond:
-                if self.error:
-                    raise RuntimeError()
+            # Reading a bool is atomic, so there is no need to take the lock
+            # just to check it.
+            if self.error:
+                raise RuntimeError()
 
-            return func(self, *args, *kwargs)
+            return func(self, *args, **kwargs)
 
         return error_check
 
-    def _get_ts(self, item):
-
+    def _get_ts(self, item, counters):
+        '''
+        Probe item, counting the probe in counters. Pass self.counters only
+        while holding self.cond.
+        '''
         item_type = self.g[item]
         ts_func = self.ts_rules[item_type]
-        return ts_func(item)
+        start = time.perf_counter()
+        if self.tracer:
+            t_start = self.tracer.now()
+            ts = ts_func(item)
+            self.tracer.complete(item, "probe", t_start)
+        else:
+            ts = ts_func(item)
+
+        c = counters
+        c["workqueue_ts_probes_total"] = c.get("workqueue_ts_probes_total", 0) + 1
+        c["workqueue_ts_probes_seconds_total"] = c.get("workqueue_ts_probes_seconds_total", 0) + time.perf_counter() - start
+        return ts
 
     def _is_out_of_date(self, item):
 
+        c = self.counters
+
         # If we've already evaluated an object, we can exit immediately
         if item in self.out_of_date:
             assert not item in self.in_date
+            c["workqueue_analysis_hits_total"] = c.get("workqueue_analysis_hits_total", 0) + 1
             return True
 
         if item in self.in_date:
+            c["workqueue_analysis_hits_total"] = c.get("workqueue_analysis_hits_total", 0) + 1
             return False
 
-        ts = self._get_ts(item)
+        c["workqueue_analysis_misses_total"] = c.get("workqueue_analysis_misses_total", 0) + 1
+
+        v = self.g.vertices[item]
+
+        # Phony items are never probed, they get the timestamp of their newest
+        # predecessor once those are known
+        if v.phony:
+            ts = -1
+        else:
+            ts = self._get_ts(item, c)
         self.timestamps[item] = ts
 
         depends = set()
-        ood = (ts == -1)
-        for l_pred in self.g.get_direct_predecessors(item):
+        order_depends = set()
+        ood = (ts == -1) and not v.phony
+        for l_pred in v.predecessors:
+            order_only = l_pred in v.order_only
             if self._is_out_of_date(l_pred):
                 # The predecessor is itself out of date. Add it to our list of
-                # dependencies
-                depends.add(l_pred)
+                # dependencies. If it's order-only it has to be built first,
+                # but only if item is built at all.
+                if order_only:
+                    order_depends.add(l_pred)
+                else:
+                    depends.add(l_pred)
+            elif order_only or v.phony:
+                pass
             elif ts < self.timestamps[l_pred]:
                 # The predecessor is not out-of-date itself but it is newer
                 # than item, so item must be out-of-date.
@@ -57,7 +94,11 @@ class WorkQueue:
         if depends:
             # Depends on things that are out of date
             self.out_of_date.add(item)
-            self.depends[item] = depends
+            self.depends[item] = depends | order_depends
+            return True
+        elif ood and order_depends:
+            self.out_of_date.add(item)
+            self.depends[item] = order_depends
             return True
         elif ood:
             # The item doesn't depend on anything that is out-of-date, but is
@@ -67,23 +108,52 @@ class WorkQueue:
             return True
         else:
             # The item is in-date
+            if v.phony:
+                self.timestamps[item] = self._phony_ts(item)
             self.in_date.add(item)
             return False
 
+    def _phony_ts(self, item):
+        v = self.g.vertices[item]
+        return max((self.timestamps[x] for x in v.predecessors if not x in v.order_only), default=-1)
+
 
     def get_updated(self):
         '''
-        Return a list of all the leaf nodes that are newer than any root nodes
+        Yield every leaf node that is newer than a root node reachable from
+        it. Each leaf is yielded once.
+
+        Roots are walked in ascending timestamp order, searching backwards
+        through their predecessors. The first root to reach a vertex is
+        therefore the oldest root that depends on it, so every vertex only
+        needs to be visited once.
         '''
 
-        for item in self.g.root_nodes:
-            for n_item in self.g.leaf_nodes:
-                if self.timestamps[item] < self.timestamps[n_item]:
-                    yield n_item
-        pass
+        roots = [x for x in self.g.root_nodes if x in self.timestamps]
+        roots.sort(key=lambda x: self.timestamps[x])
+
+        seen = set()
+        for root in roots:
+            if root in seen:
+                continue
+
+            root_ts = self.timestamps[root]
+            seen.add(root)
+            stack = [root]
+            while stack:
+                item = stack.pop()
+                if item in self.g.leaf_nodes:
+                    if self.timestamps.get(item, -1) > root_ts:
+                        yield item
 
+                for pred in self.g.get_direct_predecessors(item):
+                    if not pred in seen:
+                        seen.add(pred)
+                        stack.append(pred)
 
-    def __init__(self, graph, ts_rule_dict):
+
+    def __init__(self, graph, ts_rule_dict, *, tracer=None, action_cache=None,
+                 resources=None, jobserver=None, keep_going=False):
 
         self.g = graph
 
@@ -94,84 +164,611 @@ class WorkQueue:
         self.inprogress = set()
         self.ts_rules = ts_rule_dict
 
-        self.cond = Condition()
+        # A plain Lock is cheaper than the default RLock. Nothing may take
+        # self.cond while already holding it, use the _done helper instead of
+        # done() inside the critical section.
+        self.cond = Condition(Lock())
         self.error = False
 
         self.timestamps = {}
         self.depends = {}
+        self.targets = set()
+
+        # Engine metrics, only updated while holding self.cond
+        self.counters = {}
+        metrics.track(self, self.counters)
+
+        self.tracer = tracer
+        self.action_cache = action_cache
+        self.resources = resources
+        self.jobserver = jobserver
+        self.batches = {}
+
+        # Maps an item handed out for a multi-output group to the other
+        # out-of-date and in-date outputs of the group
+        self.running_groups = {}
+
+        # With keep_going, a failed item only stops what depends on it
+        self.keep_going = keep_going
+        self.failed = set()
+        self.skipped = set()
 
     def activate(self, entry):
-        self._is_out_of_date(entry)
+        if self.tracer:
+            start = self.tracer.now()
+
+        with self.cond:
+            self.targets.add(entry)
+            self._is_out_of_date(entry)
+            if self.tracer:
+                self.tracer.complete(f"activate {entry}", "analysis", start)
+            if self.ready:
+                self.cond.notify(len(self.ready))
+
+    def invalidate(self, *items):
+        '''
+        Forget the evaluated state of items and of everything evaluated after
+        them, so that the next `activate` probes them again. Items that are in
+        progress are left alone. Meant to be called between builds when files
+        have changed.
+        '''
+        with self.cond:
+            self._invalidate(items)
+
+    def _invalidate(self, items):
+        stack = deque(items)
+        seen = set()
+        while stack:
+            item = stack.pop()
+            if item in seen:
+                continue
+            seen.add(item)
+
+            if item in self.in_date:
+                self.in_date.remove(item)
+                del self.timestamps[item]
+            elif item in self.inprogress:
+                pass
+            elif item in self.out_of_date:
+                self.out_of_date.remove(item)
+                self.ready.discard(item)
+                self.depends.pop(item, None)
+                del self.timestamps[item]
+            else:
+                # Never evaluated, so neither were its successors
+                continue
+
+            if item in self.g:
+                stack.extend(self.g.get_direct_successors(item))
+
+    def reset(self):
+        '''
+        Drop all evaluated state, including a previous error.
+        '''
+        with self.cond:
+            self.out_of_date.clear()
+            self.in_date.clear()
+            self.ready.clear()
+            self.inprogress.clear()
+            self.timestamps.clear()
+            self.depends.clear()
+            self.targets.clear()
+            self.batches.clear()
+            self.running_groups.clear()
+            self.failed.clear()
+            self.skipped.clear()
+            self.error = False
+
+    def add_vertex(self, key, value=None):
+        '''
+        Add a vertex to the graph while the queue is running.
+        '''
+        with self.cond:
+            self.g.add_vertex(key, value)
+
+    def add_edge(self, dst, *srcs, kind=NORMAL):
+        '''
+        Add edges to the graph while the queue is running, e.g. from a depfile
+        written by a scanner or code generator. Out-of-date prerequisites are
+        scheduled and block dst until they're done. If dst was already built
+        or found in-date, it and what depends on it are looked at again.
+        '''
+        with self.cond:
+            # Checked before anything is analyzed, Graph.add_edge would only
+            # raise after that
+            for src in srcs:
+                if src not in self.g:
+                    raise Exception(f"{src} not present in graph.")
+                if src != dst and src in self.g.groups.get(dst, ()):
+                    raise Exception(f"{src} and {dst} are made by the same action.")
+
+            # Prerequisites of an item that wasn't evaluated are looked at when
+            # (if ever) it is, and an order-only prerequisite of an in-date
+            # item isn't needed at all
+            if not dst in self.out_of_date and not dst in self.in_date:
+                srcs_to_check = ()
+            elif dst in self.in_date and kind == ORDER_ONLY:
+                srcs_to_check = ()
+            else:
+                srcs_to_check = srcs
+
+            stale = False
+            for src in srcs_to_check:
+                if self._is_out_of_date(src):
+                    if dst in self.inprogress:
+                        raise Exception(f"{src} was discovered after {dst} started")
+                    elif dst in self.out_of_date:
+                        self.depends.setdefault(dst, set()).add(src)
+                        self.ready.discard(dst)
+                    elif dst in self.in_date and kind == NORMAL:
+                        stale = True
+                elif kind == ORDER_ONLY:
+                    pass
+                elif dst in self.in_date and self.timestamps[src] > self.timestamps[dst]:
+                    stale = True
+
+            self.g.add_edge(dst, *srcs, kind=kind)
+
+            if stale:
+                self._invalidate([dst])
+                for t in self.targets:
+                    self._is_out_of_date(t)
+
+            self.cond.notify_all()
 
     def ready_count(self):
         with self.cond:
             return len(self.ready)
 
+    def _done(self):
+        no_more_work = not self.out_of_date and not self.ready and not self.inprogress
+        return no_more_work or self.error
+
     def done(self):
         with self.cond:
-            no_more_work = (len(self.out_of_date) == 0) and (len(self.ready) == 0) and (len(self.inprogress) == 0)
-            return no_more_work or self.error
+            return self._done()
 
     @raises_on_error
-    def mark_done(self, name):
+    def mark_done(self, name, ts=None):
+        '''
+        Mark an item as built. Its new timestamp is probed unless it's passed
+        in as ts, e.g. when the item was built somewhere else.
+
+        name can also be a list of items handed out together by get_batch,
+        in which case ts is a list as well (or None).
+        '''
+        if isinstance(name, list):
+            names = name
+            tss = ts
+        else:
+            names = [name]
+            tss = None if ts is None else [ts]
+
+        self._mark_done(names, tss)
+        if self.action_cache:
+            for n in names:
+                self.action_cache.store(n)
+
+    def _mark_done(self, names, tss=None):
+
+        if tss is None:
+            tss = [None] * len(names)
+
+        # The other outputs of a multi-output group are done together with
+        # the item that was handed out for the group
+        done = []
+        group_members = set()
+        refresh = []
+        for name, ts in zip(names, tss):
+            done.append((name, ts))
+            members, in_date = self.running_groups.get(name, ((), ()))
+            done.extend((m, None) for m in members)
+            group_members.update(members)
+            refresh.extend(in_date)
+
+        # Probing the new timestamps and comparing them against the
+        # predecessors only reads state that can't change while the items are
+        # in progress, so it is done before taking the lock. The exception is
+        # the set of predecessors, which add_edge can grow.
+        probes = {}
+        new_tss = []
+        for name, ts in done:
+            new_ts = self._get_ts(name, probes) if ts is None else ts
+
+            # Copying the set is atomic where iterating over it isn't
+            v = self.g.vertices[name]
+            dps = (x for x in v.predecessors.copy() if not x in v.order_only)
+            if any(self.timestamps.get(x, -1) > new_ts for x in dps):
+                raise Exception(f"{name} was not updated!")
+
+            new_tss.append((name, new_ts))
+
+        refreshed = [(x, self._get_ts(x, probes)) for x in refresh]
+
         with self.cond:
+            held = time.perf_counter()
+            tokens = 0
 
-            assert name in self.timestamps
+            for name in names:
+                if not name in self.inprogress:
+                    raise Exception(f"{name} was not handed out")
 
-            # Update the timestamp for name
-            new_ts = self._get_ts(name)
-            self.timestamps[name] = new_ts
+            for name in names:
+                self.running_groups.pop(name, None)
 
-            dps = self.g.get_direct_predecessors(name)
-            if any(self.timestamps[x] > new_ts for x in dps):
-                raise Exception(f"{name} was not updated!")
+            for name, new_ts in refreshed:
+                self.timestamps[name] = new_ts
+
+            for name, new_ts in new_tss:
 
-            self.out_of_date.remove(name)
-            self.inprogress.remove(name)
+                assert name in self.timestamps
+                self.timestamps[name] = new_ts
 
+                # Group members were taken off the queue when the group was
+                # handed out
+                if not name in group_members:
+                    self.out_of_date.remove(name)
+                    tokens += self._release(name)
+
+                # Keep the result around for later activations
+                self.in_date.add(name)
+                self._release_successors(name)
+
+            if self._done():
+                self.cond.notify_all()
+            elif self.ready:
+                self.cond.notify(len(self.ready))
+
+            c = self.counters
+            for k, v in probes.items():
+                c[k] = c.get(k, 0) + v
+            c["workqueue_items_done_total"] = c.get("workqueue_items_done_total", 0) + len(new_tss)
+            c["workqueue_lock_held_seconds_total"] = c.get("workqueue_lock_held_seconds_total", 0) + time.perf_counter() - held
+
+        self._release_tokens(tokens)
+        if self.tracer:
+            for name in names:
+                self.tracer.end(name)
+
+    def _release_successors(self, name):
+        stack = [name]
+        while stack:
+            name = stack.pop()
             for item in self.g.get_direct_successors(name):
 
                 # Remove name from all of its direct successor's dependencies
                 # and if there are no dependencies remaining, add it to the
-                # ready queue.
+                # ready queue. Successors that were never activated have no
+                # dependencies recorded.
+                if not item in self.depends:
+                    continue
+
                 self.depends[item].remove(name)
-                if not self.depends[item]:
+                if self.depends[item]:
+                    continue
+
+                del self.depends[item]
+                if self.g.vertices[item].phony:
+                    # There is nothing to build for a phony item, it's done as
+                    # soon as its predecessors are
+                    self.timestamps[item] = self._phony_ts(item)
+                    self.out_of_date.remove(item)
+                    self.in_date.add(item)
+                    stack.append(item)
+                else:
                     self.ready.add(item)
 
-            if self.done():
-                self.cond.notify_all()
-            else:
-                self.cond.notify(self.ready_count())
+    def _release(self, name):
+        '''
+        Take name out of progress and give back the resources it holds. Must
+        be called with self.cond held, returns how many jobserver tokens to
+        give back once it's released.
+        '''
+        self.inprogress.remove(name)
+        if self.resources:
+            self.resources.release(self.g[name])
 
-    def mark_error(self):
+        if not self.jobserver:
+            return 0
+
+        # The items of a batch share one token
+        batch = self.batches.pop(name, None)
+        if batch is None:
+            return 1
+
+        batch.discard(name)
+        return 0 if batch else 1
+
+    def _release_tokens(self, tokens):
+        for _ in range(tokens):
+            self.jobserver.release()
+
+    def _put_back(self, name):
+        '''
+        Put an item that was handed out back on the ready queue, together
+        with the other outputs of its group. Must be called with self.cond
+        held, returns how many jobserver tokens to give back.
+        '''
+        tokens = self._release(name)
+        self.ready.add(name)
+
+        members, _ = self.running_groups.pop(name, ((), ()))
+        self.out_of_date.update(members)
+        self.ready.update(members)
+        return tokens
+
+    def requeue(self, name):
+        '''
+        Hand an item that is in progress out again, e.g. because the worker
+        building it went away.
+        '''
         with self.cond:
-            self.error = True
+            tokens = self._put_back(name)
             self.cond.notify_all()
 
+        self._release_tokens(tokens)
+
+        if self.tracer:
+            self.tracer.end(name, args={"requeued": True})
+
+    def mark_error(self, name=None):
+        names = name if isinstance(name, list) else [name]
+
+        if self.tracer:
+            for n in names:
+                if n is not None:
+                    self.tracer.end(n, args={"error": True})
+
+        with self.cond:
+            tokens = 0
+            for n in names:
+                if n in self.inprogress:
+                    tokens += self._release(n)
+
+            if self.keep_going and not None in names:
+                for n in names:
+                    members, _ = self.running_groups.pop(n, ((), ()))
+                    for m in (n,) + tuple(members):
+                        self._poison(m)
+            else:
+                self.error = True
+            self.cond.notify_all()
+
+        self._release_tokens(tokens)
+
+    def _poison(self, name):
+        '''
+        Record name as failed and skip everything waiting on it. Must be
+        called with self.cond held.
+        '''
+        self.out_of_date.discard(name)
+        self.failed.add(name)
+
+        stack = list(self.g.get_direct_successors(name))
+        while stack:
+            item = stack.pop()
+            # Only out-of-date items can be waiting on a failed one
+            if not item in self.out_of_date:
+                continue
+
+            self.out_of_date.remove(item)
+            self.ready.discard(item)
+            self.depends.pop(item, None)
+            self.skipped.add(item)
+            stack.extend(self.g.get_direct_successors(item))
+
+    def summary(self):
+        '''
+        The items that failed and the ones skipped because they depend on a
+        failed item.
+        '''
+        with self.cond:
+            return {"failed": set(self.failed), "skipped": set(self.skipped)}
+
+    def _hand_out(self, items, wait):
+        '''
+        Take a jobserver token for items, trace them and restore whatever is
+        in the action cache. Returns the items left to run, or None if no
+        token was available.
+        '''
+        if items and self.jobserver:
+            if not self.jobserver.acquire(wait):
+                # No token was taken, so there is none to give back
+                with self.cond:
+                    for o in items:
+                        self._put_back(o)
+                    self.cond.notify_all()
+                return None
+
+            if len(items) > 1:
+                shared = set(items)
+                with self.cond:
+                    for o in items:
+                        self.batches[o] = shared
+
+        if self.tracer:
+            for o in items:
+                self.tracer.begin(o)
+
+        if not self.action_cache:
+            return items
+
+        try:
+            restored = [o for o in items if self.action_cache.restore(o)]
+        except BaseException:
+            # Don't leave the items in progress forever
+            with self.cond:
+                tokens = sum(self._put_back(o) for o in items)
+                self.cond.notify_all()
+            self._release_tokens(tokens)
+            if self.tracer:
+                for o in items:
+                    self.tracer.end(o, args={"requeued": True})
+            raise
+
+        if restored:
+            # The outputs were restored from the cache, so there is nothing
+            # to run for these items.
+            metrics.inc("action_cache_hits_total", len(restored))
+            self._mark_done(restored)
+            restored = set(restored)
+
+        return [o for o in items if not o in restored]
+
     @raises_on_error
     def get_item(self, wait=False):
-        with self.cond:
-            # If there will never be items, return None
-            if self.done():
+        while True:
+            items = self._get_items(wait, self._pop_one)
+            if not items:
                 return None
+            if not (self.jobserver or self.tracer or self.action_cache):
+                return items[0]
 
-            if wait:
-                # If we are waiting and there are no items, wait to be signalled
-                if not self.ready:
-                    self.cond.wait_for(lambda:self.done() or self.ready_count() > 0)
+            left = self._hand_out(items, wait)
+            if left is None:
+                return None
+            if left:
+                return left[0]
+            # Restored from the cache, look for something else to do
 
-                # If we were awoken after the work queue was complete, return None
-                if self.done():
-                    return None
+    @raises_on_error
+    def get_batch(self, item_type=None, max_items=None, wait=False):
+        '''
+        Hand out up to max_items ready items of the same rule type, so that
+        a single action can build all of them (e.g. one compiler invocation
+        for several sources). Without an item_type, the type with the most
+        ready items is picked. Returns an empty list when there is nothing to
+        hand out. Pass the whole list to mark_done once the action finished.
+        '''
+        pop = lambda: self._pop_batch(item_type, max_items)
+        while True:
+            items = self._get_items(wait, pop, item_type)
+            left = self._hand_out(items, wait)
+            if not items or left is None:
+                return []
+            if left:
+                return left
+            # Restored from the cache, look for something else to do
+
+    def _group_ready(self, item):
+        '''
+        A multi-output group can only be handed out once none of its
+        out-of-date outputs is still waiting on something.
+        '''
+        group = self.g.groups.get(item)
+        if not group:
+            return True
 
-                assert self.ready
+        return all(x in self.ready or not x in self.out_of_date for x in group)
 
-            if self.ready:
-                o = self.ready.pop()
-                self.inprogress.add(o)
-            else:
-                o = None
+    def _take_group(self, item):
+        '''
+        Take the other outputs of item's group off the queue, they are done
+        when item is.
+        '''
+        group = self.g.groups.get(item)
+        if not group:
+            return
+
+        members = []
+        in_date = []
+        for x in group:
+            if x == item:
+                continue
+            if x in self.out_of_date:
+                self.out_of_date.remove(x)
+                self.ready.discard(x)
+                members.append(x)
+            elif x in self.in_date:
+                in_date.append(x)
+
+        self.running_groups[item] = (members, in_date)
+
+    def _fits(self, item, item_type=None):
+        t = self.g[item]
+        if item_type is not None and t != item_type:
+            return False
+
+        if self.g.groups and not self._group_ready(item):
+            return False
+
+        return not self.resources or self.resources.fits(t)
+
+    def _can_pop(self, item_type=None):
+        if item_type is None and not self.resources and not self.g.groups:
+            return bool(self.ready)
+
+        return any(self._fits(x, item_type) for x in self.ready)
+
+    def _pop_one(self):
+        if not self.resources and not self.g.groups:
+            return [self.ready.pop()] if self.ready else []
+
+        for item in self.ready:
+            if self._fits(item):
+                self.ready.remove(item)
+                if self.resources:
+                    self.resources.acquire(self.g[item])
+                self._take_group(item)
+                return [item]
 
-            return o
+        return []
+
+    def _pop_batch(self, item_type, max_items):
+        if item_type is None:
+            # Pick the rule type with the most ready items
+            counts = Counter(self.g[x] for x in self.ready if self._fits(x))
+            if not counts:
+                return []
+            item_type = counts.most_common(1)[0][0]
+
+        batch = []
+        for item in list(self.ready):
+            if max_items is not None and len(batch) >= max_items:
+                break
+
+            # Might have been taken along with an earlier item's group
+            if not item in self.ready:
+                continue
+
+            if self._fits(item, item_type):
+                self.ready.remove(item)
+                if self.resources:
+                    self.resources.acquire(item_type)
+                self._take_group(item)
+                batch.append(item)
+
+        return batch
+
+    def _get_items(self, wait, pop, item_type=None):
+        with self.cond:
+            held = time.perf_counter()
+            waited = 0
+
+            if wait and not self._done() and not self._can_pop(item_type):
+                # If we are waiting and there are no items, wait to be
+                # signalled. Adaptive resource limits change without anyone
+                # signalling, so look again every once in a while.
+                timeout = None
+                if self.resources and self.resources.adaptive:
+                    timeout = self.resources.interval
+
+                pred = lambda: self._done() or self._can_pop(item_type)
+                while not self.cond.wait_for(pred, timeout):
+                    pass
+                waited = time.perf_counter() - held
+
+            # If there will never be items (or we were awoken after the work
+            # queue was complete), there is nothing to hand out
+            if self._done():
+                items = []
+            else:
+                items = pop()
+                self.inprogress.update(items)
 
+            c = self.counters
+            c["workqueue_lock_held_seconds_total"] = c.get("workqueue_lock_held_seconds_total", 0) + time.perf_counter() - held - waited
+            if waited:
+                c["workqueue_cond_wait_seconds_total"] = c.get("workqueue_cond_wait_seconds_total", 0) + waited
 
+        return items
@@ -0,0 +1,169 @@
+
+import os
+import tempfile
+import unittest
+
+from ilmklib import ActionCache, Graph, WorkQueue
+
+
+def getfileage(name):
+    try:
+        return os.path.getmtime(name)
+    except OSError:
+        return -1
+
+
+class TestActionCache(unittest.TestCase):
+
+    def setUp(self):
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp.name, "cache")
+        self.src = os.path.join(self.tmp.name, "foo.c")
+        self.obj = os.path.join(self.tmp.name, "foo.o")
+        self.app = os.path.join(self.tmp.name, "app")
+        self.write(self.src, "int main(void) { return 0; }\n")
+
+        self.g = Graph()
+        self.g[self.src] = "file"
+        self.g[self.obj] = "compile"
+        self.g[self.app] = "link"
+        self.g.add_edge(self.obj, self.src)
+        self.g.add_edge(self.app, self.obj)
+
+        self.ran = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, path, text):
+        with open(path, "w") as f:
+            f.write(text)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def command(self, item):
+        if self.g[item] == "file":
+            return None
+        return f"{self.g[item]} {item}"
+
+    def build(self, **kwargs):
+        rules = {x: getfileage for x in ["file", "compile", "link"]}
+        cache = ActionCache(self.cache_dir, self.g, self.command, **kwargs)
+        w = WorkQueue(self.g, rules, action_cache=cache)
+        w.activate(self.app)
+        while True:
+            item = w.get_item()
+            if item is None:
+                break
+            self.ran.append(item)
+            # Writes every output of a multi-output group
+            for o in self.g.groups.get(item, (item,)):
+                pred = next(p for p in self.g.get_direct_predecessors(o)
+                            if not self.g.is_order_only(o, p))
+                self.write(o, self.read(pred).upper())
+            w.mark_done(item)
+
+        self.assertTrue(w.done())
+
+    def test_restore(self):
+
+        self.build()
+        self.assertEqual(self.ran, [self.obj, self.app])
+        expected = self.read(self.app)
+
+        # A clean build with the same inputs doesn't run anything
+        os.unlink(self.obj)
+        os.unlink(self.app)
+        self.ran.clear()
+        self.build()
+        self.assertEqual(self.ran, [])
+        self.assertEqual(self.read(self.app), expected)
+
+        # Changing the source misses the cache
+        os.unlink(self.obj)
+        os.unlink(self.app)
+        self.write(self.src, "int main(void) { return 1; }\n")
+        self.build()
+        self.assertEqual(self.ran, [self.obj, self.app])
+        self.assertIn("RETURN 1", self.read(self.app))
+
+    def test_hardlink(self):
+
+        self.build()
+        os.unlink(self.obj)
+        os.unlink(self.app)
+        self.ran.clear()
+        self.build(hardlink=True)
+        self.assertEqual(self.ran, [])
+        self.assertGreater(os.stat(self.app).st_nlink, 1)
+
+    def test_group(self):
+
+        hdr = os.path.join(self.tmp.name, "foo.h")
+        self.g[hdr] = "compile"
+        self.g.add_edge(hdr, self.src)
+        self.g.add_group(self.obj, hdr)
+        self.g.add_edge(self.app, hdr)
+
+        self.build()
+        self.assertEqual(len(self.ran), 2)
+
+        # Both outputs come back from the cache, whichever was handed out
+        os.unlink(self.obj)
+        os.unlink(hdr)
+        os.unlink(self.app)
+        self.ran.clear()
+        self.build()
+        self.assertEqual(self.ran, [])
+        self.assertIn("RETURN 0", self.read(hdr))
+
+    def test_order_only(self):
+
+        out = os.path.join(self.tmp.name, "out")
+        os.mkdir(out)
+        self.g[out] = "file"
+        self.g.add_edge(self.obj, out, kind="order_only")
+
+        cache = ActionCache(self.cache_dir, self.g, self.command)
+        k = cache.key(self.obj)
+
+        # The directory changing doesn't matter
+        self.write(os.path.join(out, "other"), "x")
+        self.assertEqual(k, cache.key(self.obj))
+
+        self.build()
+        self.assertEqual(self.ran, [self.obj, self.app])
+
+    def test_restore_error(self):
+
+        def command(item):
+            raise OSError("cache unavailable")
+
+        rules = {x: getfileage for x in ["file", "compile", "link"]}
+        cache = ActionCache(self.cache_dir, self.g, command)
+        w = WorkQueue(self.g, rules, action_cache=cache)
+        w.activate(self.app)
+        with self.assertRaises(OSError):
+            w.get_item()
+
+        # The item isn't stuck in progress
+        self.assertEqual(w.inprogress, set())
+        self.assertEqual(w.ready, {self.obj})
+
+    def test_key(self):
+
+        cache = ActionCache(self.cache_dir, self.g, self.command)
+        self.assertIsNone(cache.key(self.src))
+
+        k = cache.key(self.obj)
+        self.assertEqual(k, cache.key(self.obj))
+        self.write(self.src, "changed\n")
+        self.assertNotEqual(k, cache.key(self.obj))
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,131 @@
+
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+
+from ilmklib import Coordinator, Graph, WorkQueue, run_worker
+
+
+def getfileage(name):
+    try:
+        return os.path.getmtime(name)
+    except OSError:
+        return -1
+
+
+def build(name):
+    with open(name, "w") as f:
+        f.write("")
+    return os.path.getmtime(name)
+
+
+def crash(name):
+    os._exit(1)
+
+
+def hang(name):
+    time.sleep(60)
+
+
+class TestDistributed(unittest.TestCase):
+
+    def setUp(self):
+
+        self.ctx = multiprocessing.get_context("fork")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.sock = os.path.join(self.tmp.name, "coordinator.sock")
+
+        # app <- n objects <- n sources
+        self.g = Graph()
+        self.app = os.path.join(self.tmp.name, "app")
+        self.g[self.app] = "file"
+        for i in range(8):
+            src = os.path.join(self.tmp.name, f"{i}.c")
+            obj = os.path.join(self.tmp.name, f"{i}.o")
+            build(src)
+            self.g[src] = "file"
+            self.g[obj] = "file"
+            self.g.add_edge(obj, src)
+            self.g.add_edge(self.app, obj)
+
+        self.procs = []
+
+    def tearDown(self):
+        for p in self.procs:
+            p.kill()
+            p.join()
+        self.tmp.cleanup()
+
+    def start_worker(self, run_item, **kwargs):
+        p = self.ctx.Process(target=run_worker, args=(self.sock, run_item), kwargs=kwargs)
+        p.start()
+        self.procs.append(p)
+        return p
+
+    def start_coordinator(self, **kwargs):
+        wq = WorkQueue(self.g, {"file": getfileage})
+        wq.activate(self.app)
+        c = Coordinator(wq, self.sock, **kwargs)
+        c.start()
+        return wq, c
+
+    def check_built(self, wq):
+        self.assertTrue(wq.done())
+        self.assertFalse(wq.error)
+        for name, _ in self.g.items():
+            self.assertTrue(os.path.exists(name))
+
+    def test_workers(self):
+
+        wq, c = self.start_coordinator()
+        for _ in range(3):
+            self.start_worker(build)
+
+        self.assertTrue(c.wait(10))
+        c.close()
+        self.check_built(wq)
+
+        for p in self.procs:
+            p.join(5)
+            self.assertEqual(p.exitcode, 0)
+
+    def test_dead_worker(self):
+
+        wq, c = self.start_coordinator()
+        p = self.start_worker(crash)
+        p.join(5)
+
+        # The crashed worker's item is handed to the next worker
+        self.start_worker(build)
+        self.assertTrue(c.wait(10))
+        c.close()
+        self.check_built(wq)
+
+    def test_missed_heartbeats(self):
+
+        wq, c = self.start_coordinator(heartbeat_timeout=0.2)
+        self.start_worker(hang, heartbeat_interval=60)
+
+        while not wq.inprogress:
+            time.sleep(0.01)
+
+        self.start_worker(build)
+        self.assertTrue(c.wait(10))
+        c.close()
+        self.check_built(wq)
+
+    def test_error(self):
+
+        wq, c = self.start_coordinator()
+        self.start_worker(lambda name: 1 / 0)
+
+        self.assertTrue(c.wait(10))
+        c.close()
+        self.assertTrue(wq.error)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
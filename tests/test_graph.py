@@ -296,6 +296,171 @@ class TestGraph(unittest.TestCase):
         with self.assertRaises(TypeError):
             g.add_edges("a", "b")
 
+    def test_remove_edge(self):
+
+        g = Graph()
+        g.add_vertex("a")
+        g.add_vertex("b")
+        g.add_vertex("c")
+
+        g.add_edge("a", "b", "c")
+        self.assertEqual(g.leaf_nodes, {"b", "c"})
+        self.assertEqual(g.root_nodes, {"a"})
+
+        g.remove_edge("a", "b")
+        self.assertEqual(list(g.get_direct_predecessors("a")), ["c"])
+        self.assertEqual(list(g.get_direct_successors("b")), [])
+        self.assertEqual(g.leaf_nodes, {"b", "c"})
+        self.assertEqual(g.root_nodes, {"a", "b"})
+
+        g.remove_edge("a", "c")
+        self.assertEqual(g.leaf_nodes, {"a", "b", "c"})
+        self.assertEqual(g.root_nodes, {"a", "b", "c"})
+
+        with self.assertRaises(Exception):
+            # The edge no longer exists
+            g.remove_edge("a", "c")
+
+        with self.assertRaises(Exception):
+            g.remove_edge("a", "d")
+
+        g.add_edge("a", "a")
+        self.assertTrue(g.is_cyclic())
+        g.remove_edge("a", "a")
+        self.assertFalse(g.direct_cyclic)
+        self.assertFalse(g.is_cyclic())
+
+    def test_remove_vertex(self):
+
+        g = Graph()
+        g.add_vertex("a")
+        g.add_vertex("b")
+        g.add_vertex("c")
+
+        # a -> b -> c
+        g.add_edge("b", "a")
+        g.add_edge("c", "b")
+
+        g.remove_vertex("b")
+        self.assertNotIn("b", g)
+        self.assertEqual(len(g), 2)
+        self.assertEqual(g.leaf_nodes, {"a", "c"})
+        self.assertEqual(g.root_nodes, {"a", "c"})
+        self.assertEqual(list(g.get_direct_successors("a")), [])
+        self.assertEqual(list(g.get_direct_predecessors("c")), [])
+
+        with self.assertRaises(Exception):
+            g.remove_vertex("b")
+
+        g.add_edge("a", "a")
+        g.remove_vertex("a")
+        self.assertFalse(g.is_cyclic())
+
+    def test_replace_predecessors(self):
+
+        g = Graph()
+        for name in ["foo.o", "foo.c", "a.h", "b.h", "c.h"]:
+            g.add_vertex(name)
+
+        g.add_edge("foo.o", "foo.c", "a.h", "b.h")
+
+        # foo.c stops including a.h and starts including c.h
+        g.replace_predecessors("foo.o", {"foo.c", "b.h", "c.h"})
+        self.assertEqual(set(g.get_direct_predecessors("foo.o")), {"foo.c", "b.h", "c.h"})
+        self.assertEqual(list(g.get_direct_successors("a.h")), [])
+        self.assertIn("a.h", g.root_nodes)
+        self.assertNotIn("c.h", g.root_nodes)
+
+        with self.assertRaises(Exception):
+            g.replace_predecessors("foo.o", {"missing.h"})
+
+        # A failed replacement leaves the graph untouched
+        self.assertEqual(set(g.get_direct_predecessors("foo.o")), {"foo.c", "b.h", "c.h"})
+
+        g.replace_predecessors("foo.o", set())
+        self.assertIn("foo.o", g.leaf_nodes)
+
+    def test_groups(self):
+
+        g = Graph()
+        g.add_vertex("a")
+        g.add_vertex("b")
+        g.add_vertex("c")
+
+        g.add_group("a", "b", "c")
+        self.assertEqual(g.groups["b"], ("a", "b", "c"))
+
+        with self.assertRaises(Exception):
+            g.add_group("a", "d")
+
+        with self.assertRaises(Exception):
+            # Can't be in two groups
+            g.add_group("a")
+
+        g.remove_vertex("b")
+        self.assertEqual(g.groups["a"], ("a", "c"))
+        self.assertNotIn("b", g.groups)
+
+        # Members of a group can't depend on each other
+        with self.assertRaises(Exception):
+            g.add_edge("a", "c")
+
+        g.add_vertex("x.h")
+        g.add_vertex("x.c")
+        g.add_edge("x.c", "x.h")
+        with self.assertRaises(Exception):
+            g.add_group("x.c", "x.h")
+        self.assertNotIn("x.c", g.groups)
+
+    def test_edge_kinds(self):
+        g = Graph()
+        g.add_vertex("a")
+        g.add_vertex("b")
+        g.add_vertex("all", phony=True)
+
+        g.add_edge("b", "a", kind="order_only")
+        g.add_edge("all", "b")
+        self.assertTrue(g.is_order_only("b", "a"))
+        self.assertFalse(g.is_order_only("all", "b"))
+        self.assertTrue(g.is_phony("all"))
+        self.assertFalse(g.is_phony("a"))
+
+        with self.assertRaises(ValueError):
+            g.add_edge("b", "a", kind="weird")
+
+        g.remove_edge("b", "a")
+        self.assertFalse(g.is_order_only("b", "a"))
+
+    def test_partition(self):
+        g = Graph()
+        for i in range(40):
+            g.add_vertex(i)
+        # Two chains of 15 and two of 5
+        for start, length in [(0, 15), (15, 15), (30, 5), (35, 5)]:
+            for i in range(start + 1, start + length):
+                g.add_edge(i, i - 1)
+
+        self.assertEqual(sorted(len(c) for c in g.weakly_connected_components()), [5, 5, 15, 15])
+
+        shards = g.partition(2)
+        self.assertEqual([len(s) for s in shards], [20, 20])
+        for s in shards:
+            self.assertEqual(s.incoming, {})
+            self.assertEqual(len(s.graph), 20)
+
+        # The chains have to be cut now, along the edges
+        shards = g.partition(4)
+        self.assertEqual([len(s) for s in shards], [10, 10, 10, 10])
+        cut = sum(len(x) for s in shards for x in s.outgoing.values())
+        self.assertLessEqual(cut, 3)
+        shard_of = {k: s.index for s in shards for k in s.keys}
+        for s in shards:
+            # Edges between shards only point forward
+            self.assertTrue(all(i < s.index for i in s.depends_on))
+            for dst, srcs in s.incoming.items():
+                for src in srcs:
+                    self.assertIn(dst, shards[shard_of[src]].outgoing[src])
+
     def test_reaching_recursion_depth(self):
         g = Graph()
         for i in range(2000):
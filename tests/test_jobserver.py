@@ -0,0 +1,192 @@
+
+import os
+import subprocess
+import sys
+import unittest
+
+from ilmklib import Graph, JobserverClient, JobserverServer, WorkQueue
+from ilmklib import jobserver
+
+
+class TestJobserver(unittest.TestCase):
+
+    def test_client_tokens(self):
+
+        for style in ["pipe", "fifo"]:
+            s = JobserverServer(3, style=style)
+            c = JobserverClient.from_environ(s.env())
+            self.assertIsNotNone(c)
+
+            # The implicit token plus the two in the jobserver
+            for _ in range(3):
+                self.assertTrue(c.acquire(False))
+            self.assertFalse(c.acquire(False))
+
+            c.release()
+            self.assertTrue(c.acquire(False))
+            for _ in range(3):
+                c.release()
+            s.close()
+
+    def test_nonblocking(self):
+
+        s = JobserverServer(2)
+        c = s.client()
+        self.assertFalse(os.get_blocking(c.read_fd))
+        # The pipe shared with other processes is left alone
+        self.assertTrue(os.get_blocking(s.read_fd))
+
+        self.assertTrue(c.acquire(False))
+        self.assertTrue(c.acquire(False))
+
+        # Someone else takes the token between select() and read()
+        real_select = jobserver.select.select
+        def select(*args):
+            jobserver.select.select = real_select
+            return [c.read_fd], [], []
+        jobserver.select.select = select
+        try:
+            self.assertFalse(c.acquire(False))
+        finally:
+            jobserver.select.select = real_select
+
+        c.release()
+        c.release()
+        c.close()
+        s.close()
+
+    def test_from_environ(self):
+
+        self.assertIsNone(JobserverClient.from_environ({}))
+        self.assertIsNone(JobserverClient.from_environ({"MAKEFLAGS": "-k"}))
+
+        # Descriptors that weren't passed down to us
+        r, w = os.pipe()
+        os.close(r)
+        os.close(w)
+        env = {"MAKEFLAGS": f" -j4 --jobserver-auth={r},{w}"}
+        self.assertIsNone(JobserverClient.from_environ(env))
+
+        s = JobserverServer(4)
+        env = s.env({"MAKEFLAGS": "-k -j8 --jobserver-auth=98,99"})
+        self.assertEqual(env["MAKEFLAGS"], f"-k -j4 --jobserver-auth={s.read_fd},{s.write_fd}")
+        s.close()
+
+    def test_child_process(self):
+
+        s = JobserverServer(2)
+        code = (
+            "from ilmklib import JobserverClient\n"
+            "c = JobserverClient.from_environ()\n"
+            "print(c.acquire(False), c.acquire(False), c.acquire(False))\n"
+        )
+        env = s.env()
+        env["PYTHONPATH"] = os.path.join(os.path.dirname(__file__), "..")
+        o = subprocess.check_output([sys.executable, "-c", code], env=env,
+                                    pass_fds=s.pass_fds).decode()
+        self.assertEqual(o.split(), ["True", "True", "False"])
+
+        # The child didn't give the token back, so there's none left for us
+        # besides our implicit one
+        c = s.client()
+        self.assertTrue(c.acquire(False))
+        self.assertFalse(c.acquire(False))
+        s.close()
+
+    def test_work_queue(self):
+
+        files = {}
+        g = Graph()
+        g["all"] = "file"
+        for i in range(4):
+            g[f"{i}.o"] = "file"
+            g.add_edge("all", f"{i}.o")
+
+        s = JobserverServer(2)
+        w = WorkQueue(g, {"file": lambda x: files.get(x, -1)}, jobserver=s.client())
+        w.activate("all")
+
+        a = w.get_item()
+        b = w.get_item()
+        self.assertIsNotNone(a)
+        self.assertIsNotNone(b)
+
+        # Out of tokens, the item goes back to the ready set
+        self.assertIsNone(w.get_item())
+        self.assertEqual(len(w.ready), 2)
+
+        files[a] = 1
+        w.mark_done(a)
+        self.assertIsNotNone(w.get_item())
+        s.close()
+
+    def test_group(self):
+
+        files = {"gen.py": 1}
+        g = Graph()
+        for name in ["gen.py", "a.c", "a.h", "prog"]:
+            g[name] = "file"
+        g.add_edge("a.c", "gen.py")
+        g.add_edge("a.h", "gen.py")
+        g.add_group("a.c", "a.h")
+        g.add_edge("prog", "a.c", "a.h")
+
+        s = JobserverServer(1)
+        c = s.client()
+        w = WorkQueue(g, {"file": lambda x: files.get(x, -1)}, jobserver=c)
+        w.activate("prog")
+
+        # Someone else holds the only token, the whole group goes back
+        self.assertTrue(c.acquire(False))
+        self.assertIsNone(w.get_item())
+        self.assertEqual(w.ready, {"a.c", "a.h"})
+        c.release()
+
+        item = w.get_item()
+        self.assertIn(item, ["a.c", "a.h"])
+        files["a.c"] = files["a.h"] = 2
+        w.mark_done(item)
+        self.assertIn("a.c", w.in_date)
+        self.assertIn("a.h", w.in_date)
+        self.assertEqual(w.get_item(), "prog")
+        c.close()
+        s.close()
+
+    def test_batch_shares_token(self):
+
+        files = {}
+        g = Graph()
+        g["all"] = "file"
+        for i in range(4):
+            g[f"{i}.o"] = "file"
+            g.add_edge("all", f"{i}.o")
+
+        s = JobserverServer(2)
+        w = WorkQueue(g, {"file": lambda x: files.get(x, -1)}, jobserver=s.client())
+        w.activate("all")
+
+        batch = w.get_batch(max_items=3)
+        self.assertEqual(len(batch), 3)
+        last = w.get_item()
+        self.assertIsNotNone(last)
+
+        for x in batch + [last]:
+            files[x] = 1
+
+        # One token for the batch, one for the last item. The batch gives
+        # its token back only once all of it is done.
+        c = w.jobserver
+        w.mark_done(batch[:2])
+        self.assertTrue(c.implicit_used)
+        self.assertEqual(len(c.tokens), 1)
+        w.mark_done(batch[2:])
+        self.assertEqual(len(c.tokens), 0)
+        w.mark_done(last)
+        self.assertFalse(c.implicit_used)
+        self.assertEqual(w.get_item(), "all")
+        s.close()
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,124 @@
+
+import gc
+import threading
+import unittest
+
+from ilmklib import Graph, Metrics, TimestampDict, WorkQueue, metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counters(self):
+
+        m = Metrics()
+        m.inc("a_total")
+        m.inc("a_total", 2)
+        m.inc("g")
+        m.dec("g")
+        with m.timer("t"):
+            pass
+
+        d = m.as_dict()
+        self.assertEqual(d["a_total"], 3)
+        self.assertEqual(d["g"], 0)
+        self.assertEqual(d["t_total"], 1)
+        self.assertGreaterEqual(d["t_seconds_total"], 0)
+
+        text = m.to_prometheus()
+        self.assertIn("# TYPE ilmklib_a_total counter\nilmklib_a_total 3\n", text)
+        self.assertIn("# TYPE ilmklib_g gauge\nilmklib_g 0\n", text)
+
+        m.reset()
+        self.assertNotIn("a_total", m.as_dict())
+
+    def test_tracked(self):
+
+        class Owner:
+            pass
+
+        m = Metrics()
+        owner = Owner()
+        counters = {"x_total": 2, "size": 5}
+        m.track(owner, counters)
+        m.inc("x_total")
+        self.assertEqual(m.as_dict()["x_total"], 3)
+        self.assertEqual(m.as_dict()["size"], 5)
+
+        # Counters outlive their owner, gauges don't
+        del owner
+        d = m.as_dict()
+        self.assertEqual(d["x_total"], 3)
+        self.assertNotIn("size", d)
+
+    def test_retire(self):
+
+        class Owner:
+            pass
+
+        m = Metrics()
+
+        # Owners in a cycle are only freed by the garbage collector, which
+        # may run while the lock is held
+        for _ in range(100):
+            owner = Owner()
+            owner.self = owner
+            m.track(owner, {"x_total": 1})
+        del owner
+        with m.lock:
+            gc.collect()
+        self.assertEqual(m.as_dict()["x_total"], 100)
+        self.assertEqual(m.tracked, {})
+
+        # Threads that are gone don't keep their counters around
+        threads = [threading.Thread(target=m.inc, args=("y_total",)) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(m.as_dict()["y_total"], 5)
+        self.assertEqual(m.thread_counters, [])
+
+    def test_engine(self):
+
+        # Only graphs that are alive are counted
+        gc.collect()
+        Graph().add_vertex("temporary")
+        metrics.reset()
+
+        files = {"a.c": 1}
+        g = Graph()
+        g["a.c"] = "file"
+        g["a.o"] = "file"
+        g["app"] = "file"
+        g.add_edge("a.o", "a.c")
+        g.add_edge("app", "a.o")
+        g.add_edge("app", "a.o")
+
+        w = WorkQueue(g, {"file": lambda x: files.get(x, -1)})
+        w.activate("app")
+        while not w.done():
+            item = w.get_item()
+            files[item] = 2
+            w.mark_done(item)
+
+        t = TimestampDict()
+        t["a"] = "1"
+        t["a"]
+        with self.assertRaises(KeyError):
+            t["b"]
+
+        d = metrics.as_dict()
+        self.assertEqual(d["graph_vertices"], 3)
+        self.assertEqual(d["graph_edges"], 2)
+        self.assertEqual(d["workqueue_items_done_total"], 2)
+        self.assertEqual(d["workqueue_ts_probes_total"], 3 + 2)
+        self.assertEqual(d["workqueue_analysis_misses_total"], 3)
+        self.assertEqual(d["timestamp_dict_hits_total"], 1)
+        self.assertEqual(d["timestamp_dict_misses_total"], 1)
+        self.assertGreater(d["workqueue_lock_held_seconds_total"], 0)
+        self.assertGreater(d["workqueue_items_per_second"], 0)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
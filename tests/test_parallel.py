@@ -0,0 +1,62 @@
+
+import unittest
+
+from ilmklib import Graph, WorkQueue, parallel_tarjans, parallel_is_cyclic, parallel_analyze
+
+
+def ts_rule(key):
+    # Keys carry their own timestamp, so that the rule works in any process
+    return int(key.split(":")[1])
+
+
+class TestParallel(unittest.TestCase):
+
+    def _chain(self, g, prefix, length):
+        for i in range(length):
+            g.add_vertex(f"{prefix}{i}:{i + 1}", "file")
+        for i in range(1, length):
+            g.add_edge(f"{prefix}{i}:{i + 1}", f"{prefix}{i - 1}:{i}")
+
+    def test_tarjans(self):
+
+        g = Graph()
+        self._chain(g, "a", 10)
+        self._chain(g, "b", 10)
+        shards = g.partition(3)
+        self.assertFalse(parallel_is_cyclic(shards, processes=2))
+        self.assertEqual(len(parallel_tarjans(shards, processes=2)), 20)
+
+        # A cycle spanning every shard
+        g.add_edge("a0:1", "b9:10")
+        g.add_edge("b0:1", "a9:10")
+        shards = g.partition(3)
+        self.assertTrue(parallel_is_cyclic(shards, processes=2))
+        sccs = parallel_tarjans(shards, processes=2)
+        self.assertEqual(len(sccs), 1)
+        self.assertEqual(sorted(sccs[0]), sorted(g.vertices))
+
+    def test_analyze(self):
+
+        g = Graph()
+        self._chain(g, "a", 12)
+        g.add_vertex("old:0", "file")
+        g.add_edge("old:0", "a11:12")
+        g.add_vertex("missing:-1", "file")
+        g.add_edge("a3:4", "missing:-1")
+
+        shards = g.partition(4)
+        timestamps, out_of_date = parallel_analyze(shards, {"file": ts_rule}, processes=2)
+
+        w = WorkQueue(g, {"file": ts_rule})
+        for key in g.vertices:
+            w.activate(key)
+        self.assertEqual(timestamps, w.timestamps)
+        self.assertEqual(out_of_date, w.out_of_date)
+        self.assertIn("old:0", out_of_date)
+        self.assertIn("a11:12", out_of_date)
+        self.assertNotIn("a2:3", out_of_date)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,95 @@
+
+import os
+import unittest
+
+from ilmklib import Graph, ResourcePool, WorkQueue
+
+
+class TestResourcePool(unittest.TestCase):
+
+    def make_queue(self, pool):
+
+        self.files = {}
+        g = Graph()
+        g["all"] = "phony"
+        for i in range(4):
+            g[f"{i}.o"] = "compile"
+            g[f"bin{i}"] = "link"
+            g.add_edge("all", f"{i}.o", f"bin{i}")
+
+        rules = {
+            "compile": lambda x: self.files.get(x, -1),
+            "link": lambda x: self.files.get(x, -1),
+            "phony": lambda x: self.files.get(x, -1),
+        }
+        w = WorkQueue(g, rules, resources=pool)
+        w.activate("all")
+        return w
+
+    def test_limits(self):
+
+        pool = ResourcePool({"link": {"link": 1, "memory": 100}}, {"link": 2})
+        w = self.make_queue(pool)
+
+        items = []
+        while True:
+            item = w.get_item()
+            if item is None:
+                break
+            items.append(item)
+
+        # Every compile and only two links are handed out
+        self.assertEqual(sorted(x for x in items if x.endswith(".o")),
+                         ["0.o", "1.o", "2.o", "3.o"])
+        links = [x for x in items if x.startswith("bin")]
+        self.assertEqual(len(links), 2)
+        self.assertEqual(pool.in_use, {"link": 2, "memory": 200})
+
+        self.files[links[0]] = 1
+        w.mark_done(links[0])
+        self.assertTrue(w.get_item().startswith("bin"))
+        self.assertIsNone(w.get_item())
+
+    def test_oversized_item(self):
+
+        # A link needs more memory than there is, but runs on its own
+        pool = ResourcePool({"link": {"memory": 100}}, {"memory": 50})
+        w = self.make_queue(pool)
+
+        links = []
+        while True:
+            item = w.get_item()
+            if item is None:
+                break
+            if item.startswith("bin"):
+                links.append(item)
+            else:
+                self.files[item] = 1
+                w.mark_done(item)
+
+        self.assertEqual(len(links), 1)
+
+    def test_requeue_releases(self):
+
+        pool = ResourcePool({"link": {"link": 1}}, {"link": 1})
+        w = self.make_queue(pool)
+
+        items = [w.get_item() for _ in range(5)]
+        link = [x for x in items if x.startswith("bin")][0]
+        self.assertIsNone(w.get_item())
+
+        w.requeue(link)
+        self.assertTrue(w.get_item().startswith("bin"))
+
+    def test_adaptive(self):
+
+        pool = ResourcePool({"link": {"cpu": 1}}, {"cpu": 100000}, adaptive=True)
+        pool.acquire("link")
+        pool.fits("link")
+        self.assertLessEqual(pool.effective["cpu"], os.cpu_count())
+        self.assertGreaterEqual(pool.effective["cpu"], 1)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,125 @@
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from ilmklib import BuildServer, Graph
+from ilmklib.server import request
+
+
+def getfileage(name):
+    try:
+        return os.path.getmtime(name)
+    except OSError:
+        return -1
+
+
+class TestBuildServer(unittest.TestCase):
+
+    def setUp(self):
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, "foo.c")
+        self.obj = os.path.join(self.tmp.name, "foo.o")
+        with open(self.src, "w") as f:
+            f.write("int main(void) { return 0; }\n")
+
+        self.g = Graph()
+        self.g[self.src] = "file"
+        self.g[self.obj] = "file"
+        self.g.add_edge(self.obj, self.src)
+
+        self.built = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_item(self, name):
+        self.built.append(name)
+        with open(name, "w") as f:
+            f.write("")
+
+    def test_build(self):
+
+        s = BuildServer(self.g, {"file": getfileage}, self.run_item, None,
+                        watch=[self.src])
+
+        s.build(self.obj)
+        self.assertEqual(self.built, [self.obj])
+
+        # Nothing changed, so nothing is rebuilt
+        s.build(self.obj)
+        self.assertEqual(self.built, [self.obj])
+
+        with self.assertRaises(KeyError):
+            s.build("missing")
+
+    def test_on_change(self):
+
+        changed = []
+        s = BuildServer(self.g, {"file": getfileage}, self.run_item, None,
+                        watch=[self.src], on_change=changed.append)
+
+        self.assertEqual(s.poll(), set())
+
+        t = os.path.getmtime(self.src) - 10
+        os.utime(self.src, (t, t))
+        self.assertEqual(s.poll(), {self.src})
+
+        s.build(self.obj)
+        self.assertEqual(changed, [self.src])
+        self.assertEqual(self.built, [self.obj])
+
+    def test_error(self):
+
+        for i in range(3):
+            self.g[f"ok{i}"] = "file"
+        self.g["bad"] = "file"
+        self.g["all"] = "file"
+        self.g.add_edge("all", "bad", "ok0", "ok1", "ok2")
+
+        failed = threading.Event()
+        def run_item(name):
+            if name == "bad":
+                failed.set()
+                raise ValueError("bad failed")
+            failed.wait(5)
+
+        s = BuildServer(self.g, {"file": lambda name: -1}, run_item, None,
+                        jobs=4)
+
+        # The other workers only see that the build failed, the error
+        # reported is the original one
+        with self.assertRaisesRegex(ValueError, "bad failed"):
+            s.build("all")
+
+    def test_socket(self):
+
+        sock = os.path.join(self.tmp.name, "server.sock")
+        s = BuildServer(self.g, {"file": getfileage}, self.run_item, sock,
+                        watch=[self.src], poll_interval=0.01)
+
+        t = threading.Thread(target=s.serve_forever)
+        t.start()
+        try:
+            while not os.path.exists(sock):
+                time.sleep(0.01)
+
+            self.assertEqual(request(sock, f"build {self.obj}"), "ok")
+            self.assertEqual(self.built, [self.obj])
+            self.assertTrue(request(sock, "build missing").startswith("error"))
+            self.assertTrue(request(sock, "frobnicate").startswith("error"))
+            self.assertEqual(request(sock, "quit"), "ok")
+        finally:
+            t.join(5)
+            s.shutdown()
+
+        self.assertFalse(t.is_alive())
+        self.assertFalse(os.path.exists(sock))
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -1,8 +1,13 @@
 
 import unittest
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
 import time
 
-from ilmklib import TimestampDict
+from ilmklib import TimestampDict, SharedTimestampDict
 
 class TestTimestampDict(unittest.TestCase):
 
@@ -63,6 +68,108 @@ class TestTimestampDict(unittest.TestCase):
         self.assertEqual(sorted(["a", "b", "c"]), sorted(seen))
 
 
+def _set_keys(t, prefix):
+    for i in range(10):
+        t[f"{prefix}{i}"] = str(i)
+    t.close()
+
+
+class TestSharedTimestampDict(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "ts.db")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_basic(self):
+
+        with SharedTimestampDict(self.path, batch_size=2) as t:
+            t["abba"] = "1234"
+            self.assertIn("abba", t)
+            self.assertIn("tsd::/abba", t)
+            self.assertEqual(t["abba"], "1234")
+
+            del t["abba"]
+            self.assertNotIn("abba", t)
+            with self.assertRaises(KeyError):
+                t["abba"]
+            with self.assertRaises(TypeError):
+                t["abba"] = 123
+
+    def test_shared(self):
+
+        a = SharedTimestampDict(self.path)
+        b = SharedTimestampDict(self.path)
+        other = SharedTimestampDict(self.path, "other")
+
+        # Writes are only seen by others once flushed
+        a["x"] = "1"
+        self.assertNotIn("x", b)
+        a.flush()
+        self.assertEqual(b["x"], "1")
+        self.assertNotIn("x", other)
+
+        b["y"] = "2"
+        self.assertGreater(b.time("y"), a.time("x"))
+        a["x"] = "3"
+        self.assertGreater(a.time("x"), b.time("y"))
+        self.assertEqual(sorted(b), ["x", "y"])
+
+        for t in (a, b, other):
+            t.close()
+
+    def test_read_during_flush(self):
+
+        t = SharedTimestampDict(self.path)
+        t["x"] = "1"
+        t.flush()
+        t["y"] = "2"
+
+        # Another writer holds the database, so the flush has to wait
+        other = sqlite3.connect(self.path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        flusher = threading.Thread(target=t.flush)
+        flusher.start()
+        deadline = time.time() + 5
+        while t.pending and time.time() < deadline:
+            time.sleep(0.01)
+
+        # Reads don't wait for the flush
+        results = []
+        def read():
+            results.extend([t["x"], t["y"], "y" in t])
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join(5)
+        alive = reader.is_alive()
+
+        other.execute("COMMIT")
+        other.close()
+        flusher.join()
+        reader.join()
+        self.assertFalse(alive)
+        self.assertEqual(results, ["1", "2", True])
+        self.assertGreater(t.time("y"), t.time("x"))
+        t.close()
+
+    def test_processes(self):
+
+        t = SharedTimestampDict(self.path, batch_size=3)
+        ctx = multiprocessing.get_context("spawn")
+        procs = [ctx.Process(target=_set_keys, args=(t, p)) for p in "abc"]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+
+        self.assertEqual(len(list(t)), 30)
+        self.assertEqual(t["b7"], "7")
+        t.close()
+
+
 if __name__ == "__main__":
 
     unittest.main()
@@ -0,0 +1,80 @@
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from ilmklib import Graph, Tracer, WorkQueue
+
+
+class TestTracer(unittest.TestCase):
+
+    def test_work_queue_trace(self):
+
+        files = {"a.c": 1, "b.c": 1}
+
+        g = Graph()
+        for name in ["a.c", "b.c", "a.o", "b.o", "app"]:
+            g[name] = "file"
+        g.add_edge("a.o", "a.c")
+        g.add_edge("b.o", "b.c")
+        g.add_edge("app", "a.o", "b.o")
+
+        t = Tracer()
+        w = WorkQueue(g, {"file": lambda x: files.get(x, -1)}, tracer=t)
+        w.activate("app")
+
+        def worker():
+            while True:
+                item = w.get_item(wait=True)
+                if item is None:
+                    return
+                files[item] = 2
+                w.mark_done(item)
+
+        threads = [threading.Thread(target=worker) for _ in range(2)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+
+        events = [e for e in t.to_dict()["traceEvents"] if e["ph"] == "X"]
+        items = sorted(e["name"] for e in events if e["cat"] == "item")
+        self.assertEqual(items, ["a.o", "app", "b.o"])
+
+        analysis = [e["name"] for e in events if e["cat"] == "analysis"]
+        self.assertEqual(analysis, ["activate app"])
+
+        # Every vertex is probed during analysis and each item again when done
+        probes = [e["name"] for e in events if e["cat"] == "probe"]
+        self.assertEqual(len(probes), 5 + 3)
+
+        for e in events:
+            self.assertGreaterEqual(e["dur"], 0)
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "trace.json")
+            t.write(path)
+            with open(path) as f:
+                self.assertEqual(json.load(f), t.to_dict())
+
+    def test_error(self):
+
+        g = Graph()
+        g["a"] = "file"
+
+        t = Tracer()
+        w = WorkQueue(g, {"file": lambda x: -1}, tracer=t)
+        w.activate("a")
+        item = w.get_item()
+        w.mark_error(item)
+
+        items = [e for e in t.events if e["cat"] == "item"]
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]["args"], {"error": True})
+
+
+if __name__ == "__main__":
+
+    unittest.main()
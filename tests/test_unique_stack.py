@@ -1,6 +1,6 @@
 import unittest
 
-from ilmklib import UniqueStack
+from ilmklib import UniqueStack, IntUniqueStack
 
 class TestUniqueStack(unittest.TestCase):
 
@@ -77,3 +77,41 @@ class TestUniqueStack(unittest.TestCase):
         with self.assertRaises(Exception):
             s = UniqueStack(5)
 
+class TestIntUniqueStack(unittest.TestCase):
+
+    def test_ordering(self):
+
+        s = IntUniqueStack()
+        with self.assertRaises(IndexError):
+            s.pop()
+
+        for i in [3, 0, 7, 1]:
+            s.push(i)
+        self.assertEqual(len(s), 4)
+        self.assertEqual(s.peek(), 1)
+        self.assertEqual(s.pop(), 1)
+        self.assertNotIn(1, s)
+        self.assertIn(7, s)
+        self.assertNotIn(100, s)
+
+        with self.assertRaises(Exception):
+            s.push(3)
+        with self.assertRaises(ValueError):
+            s.push(-1)
+
+    def test_pop_until(self):
+
+        s = IntUniqueStack(range(6), size=2)
+        self.assertEqual(s.pop_until(2), [2, 3, 4, 5])
+        self.assertEqual(len(s), 2)
+        for i in range(2, 6):
+            self.assertNotIn(i, s)
+
+        # Popped ids can be pushed again
+        s.push(4)
+        self.assertEqual(s.pop_until(0), [0, 1, 4])
+        self.assertEqual(len(s), 0)
+
+        with self.assertRaises(Exception):
+            s.pop_until(0)
+
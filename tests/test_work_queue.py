@@ -71,6 +71,394 @@ class TestWorkQueue(unittest.TestCase):
         self.assertEqual(item, None)
 
 
+    def test_reuse(self):
+
+        files = {
+            "a.c" : 5,
+            "b.c" : 5,
+        }
+        probes = []
+
+        def getfileage(name):
+            nonlocal files
+            probes.append(name)
+            return files.get(name, -1)
+
+        g = Graph()
+        for name in ["a.c", "b.c", "a.o", "b.o", "liba", "app"]:
+            g[name] = wType.wFILE
+
+        g.add_edge("a.o", "a.c")
+        g.add_edge("b.o", "b.c")
+        g.add_edge("liba", "a.o")
+        g.add_edge("app", "a.o", "b.o")
+
+        w = WorkQueue(g, { wType.wFILE : getfileage })
+
+        w.activate("liba")
+        for expected in ["a.o", "liba"]:
+            item = w.get_item()
+            self.assertEqual(item, expected)
+            files[item] = 10
+            w.mark_done(item)
+        self.assertIsNone(w.get_item())
+        self.assertTrue(w.done())
+
+        # a.o was built for liba and must not be probed or built again
+        probes.clear()
+        w.activate("app")
+        self.assertNotIn("a.o", probes)
+        self.assertNotIn("a.c", probes)
+        for expected in ["b.o", "app"]:
+            item = w.get_item()
+            self.assertEqual(item, expected)
+            files[item] = 11
+            w.mark_done(item)
+        self.assertIsNone(w.get_item())
+
+        # Nothing to do when everything is already evaluated
+        probes.clear()
+        w.activate("app")
+        self.assertEqual(probes, [])
+        self.assertTrue(w.done())
+
+        # Only b.c and what depends on it is probed after it changes
+        files["b.c"] = 20
+        w.invalidate("b.c")
+        probes.clear()
+        w.activate("app")
+        self.assertEqual(sorted(probes), ["app", "b.c", "b.o"])
+        for expected in ["b.o", "app"]:
+            item = w.get_item()
+            self.assertEqual(item, expected)
+            files[item] = 21
+            w.mark_done(item)
+        self.assertTrue(w.done())
+
+        w.mark_error()
+        w.reset()
+        self.assertFalse(w.error)
+        w.activate("app")
+        self.assertTrue(w.done())
+
+    def test_get_updated(self):
+
+        files = {
+            "a.c" : 5,
+            "b.c" : 20,
+            "common.h" : 1,
+            "a" : 10,
+            "b" : 30,
+        }
+
+        g = Graph()
+        for name in files:
+            g[name] = wType.wFILE
+
+        # common.h is shared, a.c is only used by a and b.c only by b
+        g.add_edge("a", "a.c", "common.h")
+        g.add_edge("b", "b.c", "common.h")
+
+        w = WorkQueue(g, { wType.wFILE : lambda x: files[x] })
+        w.activate("a")
+        w.activate("b")
+        self.assertEqual(list(w.get_updated()), [])
+
+        # b.c is newer than a, but a doesn't depend on it
+        files["b.c"] = 15
+        files["common.h"] = 12
+        w.invalidate("b.c", "common.h")
+        w.activate("a")
+        w.activate("b")
+        self.assertEqual(list(w.get_updated()), ["common.h"])
+
+        files["a.c"] = 40
+        files["b.c"] = 40
+        w.invalidate("a.c", "b.c")
+        w.activate("a")
+        w.activate("b")
+        self.assertEqual(sorted(w.get_updated()), ["a.c", "b.c", "common.h"])
+
+    def test_get_batch(self):
+
+        files = {}
+
+        g = Graph()
+        g["app"] = "link"
+        g["gen.h"] = "codegen"
+        for i in range(5):
+            g[f"{i}.o"] = "compile"
+            g.add_edge("app", f"{i}.o")
+
+        rules = {x: (lambda x: files.get(x, -1)) for x in ["link", "compile", "codegen"]}
+        w = WorkQueue(g, rules)
+        w.activate("app")
+        w.activate("gen.h")
+
+        # The largest group of ready items is handed out first
+        batch = w.get_batch(max_items=3)
+        self.assertEqual(len(batch), 3)
+        self.assertTrue(all(x.endswith(".o") for x in batch))
+
+        self.assertEqual(w.get_batch("codegen"), ["gen.h"])
+        self.assertEqual(w.get_batch("codegen"), [])
+
+        rest = w.get_batch("compile")
+        self.assertEqual(len(rest), 2)
+        self.assertEqual(w.get_batch(), [])
+
+        for x in batch + rest:
+            files[x] = 1
+        w.mark_done(batch)
+
+        # app still waits for the rest of the objects
+        self.assertEqual(w.get_batch("link"), [])
+        w.mark_done(rest)
+        self.assertEqual(w.get_batch("link"), ["app"])
+
+    def test_keep_going(self):
+
+        files = {"a.c": 1, "b.c": 1, "c.c": 1}
+
+        g = Graph()
+        for name in ["a.c", "b.c", "c.c", "a.o", "b.o", "c.o", "liba", "app", "tool"]:
+            g[name] = wType.wFILE
+
+        g.add_edge("a.o", "a.c")
+        g.add_edge("b.o", "b.c")
+        g.add_edge("c.o", "c.c")
+        g.add_edge("liba", "a.o")
+        g.add_edge("app", "liba", "b.o")
+        g.add_edge("tool", "c.o")
+        g["all"] = wType.wFILE
+        g.add_edge("all", "app", "tool")
+
+        w = WorkQueue(g, { wType.wFILE : lambda x: files.get(x, -1) }, keep_going=True)
+        w.activate("all")
+
+        built = []
+        while not w.done():
+            item = w.get_item()
+            if item == "a.o":
+                w.mark_error(item)
+                continue
+
+            built.append(item)
+            files[item] = 2
+            w.mark_done(item)
+
+        self.assertFalse(w.error)
+        self.assertEqual(sorted(built), ["b.o", "c.o", "tool"])
+        self.assertEqual(w.summary(), {
+            "failed": {"a.o"},
+            "skipped": {"liba", "app", "all"},
+        })
+
+        # Without keep_going the first failure stops everything
+        w = WorkQueue(g, { wType.wFILE : lambda x: files.get(x, -1) })
+        files.clear()
+        w.activate("all")
+        w.mark_error(w.get_item())
+        self.assertTrue(w.error)
+        with self.assertRaises(RuntimeError):
+            w.get_item()
+
+    def test_discovered_dependencies(self):
+
+        files = {"foo.c": 1, "gen.py": 1}
+
+        g = Graph()
+        for name in ["foo.c", "scan", "foo.o", "app"]:
+            g[name] = wType.wFILE
+        g.add_edge("scan", "foo.c")
+        g.add_edge("foo.o", "foo.c", "scan")
+        g.add_edge("app", "foo.o")
+
+        w = WorkQueue(g, { wType.wFILE : lambda x: files.get(x, -1) })
+        w.activate("app")
+
+        self.assertEqual(w.get_item(), "scan")
+
+        # The scanner finds out that foo.c includes a generated header
+        w.add_vertex("gen.h", wType.wFILE)
+        w.add_vertex("gen.py", wType.wFILE)
+        w.add_edge("gen.h", "gen.py")
+        w.add_edge("foo.o", "gen.h")
+        files["scan"] = 2
+
+        # Nothing activated needs these, so they aren't scheduled
+        w.add_vertex("unrelated.gen", wType.wFILE)
+        w.add_vertex("unrelated.o", wType.wFILE)
+        w.add_edge("unrelated.o", "unrelated.gen")
+        self.assertNotIn("unrelated.gen", w.ready)
+        self.assertNotIn("unrelated.gen", w.timestamps)
+        w.mark_done("scan")
+
+        # gen.h has to be built before foo.o
+        self.assertEqual(w.get_item(), "gen.h")
+        self.assertIsNone(w.get_item())
+        files["gen.h"] = 3
+        w.mark_done("gen.h")
+
+        for expected in ["foo.o", "app"]:
+            item = w.get_item()
+            self.assertEqual(item, expected)
+            files[item] = 4
+            w.mark_done(item)
+        self.assertTrue(w.done())
+
+        # A prerequisite newer than an item that was already built brings it
+        # and its dependants back
+        w.add_vertex("config.h", wType.wFILE)
+        files["config.h"] = 10
+        w.add_edge("foo.o", "config.h")
+        self.assertFalse(w.done())
+        for expected in ["foo.o", "app"]:
+            item = w.get_item()
+            self.assertEqual(item, expected)
+            files[item] = 11
+            w.mark_done(item)
+        self.assertTrue(w.done())
+
+        # Prerequisites can't be added to something already running
+        w.add_vertex("late.h", wType.wFILE)
+        files["foo.c"] = 20
+        w.invalidate("foo.c")
+        w.activate("app")
+        self.assertEqual(w.get_item(), "scan")
+        with self.assertRaises(Exception):
+            w.add_edge("scan", "late.h")
+
+    def test_multi_output(self):
+
+        files = {"foo.def": 1}
+        outputs = ["foo.c", "foo.h", "foo_tbl.c"]
+
+        g = Graph()
+        for name in ["foo.def", "foo.o", "foo_tbl.o", "app"] + outputs:
+            g[name] = wType.wFILE
+        for name in outputs:
+            g.add_edge(name, "foo.def")
+        g.add_group(*outputs)
+        g.add_edge("foo.o", "foo.c", "foo.h")
+        g.add_edge("foo_tbl.o", "foo_tbl.c", "foo.h")
+        g.add_edge("app", "foo.o", "foo_tbl.o")
+
+        w = WorkQueue(g, { wType.wFILE : lambda x: files.get(x, -1) })
+        w.activate("app")
+
+        # The generator is handed out once, for one of its outputs
+        gen = w.get_item()
+        self.assertIn(gen, outputs)
+        self.assertIsNone(w.get_item())
+
+        for name in outputs:
+            files[name] = 2
+        w.mark_done(gen)
+
+        # Everything depending on any of the outputs is released together
+        self.assertEqual(sorted([w.get_item(), w.get_item()]), ["foo.o", "foo_tbl.o"])
+        for name in outputs:
+            self.assertIn(name, w.in_date)
+            self.assertEqual(w.timestamps[name], 2)
+
+    def test_order_only_and_phony(self):
+
+        files = {"gen.h": 5, "foo.c": 1, "foo.o": 3}
+        probed = []
+        def ts(x):
+            probed.append(x)
+            return files.get(x, -1)
+
+        g = Graph()
+        for name in ["gen.h", "foo.c", "foo.o"]:
+            g[name] = wType.wFILE
+        g.add_vertex("all", wType.wFILE, phony=True)
+        g.add_edge("foo.o", "foo.c")
+        g.add_edge("foo.o", "gen.h", kind="order_only")
+        g.add_edge("all", "foo.o")
+
+        # gen.h is newer than foo.o, but that doesn't matter for an
+        # order-only prerequisite
+        w = WorkQueue(g, { wType.wFILE : ts })
+        w.activate("all")
+        self.assertTrue(w.done())
+        self.assertNotIn("all", probed)
+        self.assertEqual(w.timestamps["all"], 3)
+
+        # When foo.o is rebuilt, a missing gen.h is built before it
+        del files["gen.h"]
+        files["foo.c"] = 4
+        w.reset()
+        w.activate("all")
+        self.assertEqual(w.get_item(), "gen.h")
+        self.assertIsNone(w.get_item())
+        files["gen.h"] = 6
+        w.mark_done("gen.h")
+        self.assertEqual(w.get_item(), "foo.o")
+        files["foo.o"] = 5
+        w.mark_done("foo.o")
+
+        # The phony target completes by itself
+        self.assertTrue(w.done())
+        self.assertIn("all", w.in_date)
+        self.assertEqual(w.timestamps["all"], 5)
+
+        # A missing order-only prerequisite alone is built, but doesn't make
+        # foo.o out of date
+        del files["gen.h"]
+        w.invalidate("gen.h")
+        w.activate("all")
+        self.assertEqual(w.get_item(), "gen.h")
+        files["gen.h"] = 7
+        w.mark_done("gen.h")
+        self.assertTrue(w.done())
+        self.assertIn("foo.o", w.in_date)
+
+    def test_invalidate_pending(self):
+
+        files = {"a.c" : 5}
+
+        g = Graph()
+        g["a.c"] = wType.wFILE
+        g["a"] = wType.wFILE
+        g.add_edge("a", "a.c")
+
+        w = WorkQueue(g, { wType.wFILE : lambda x: files.get(x, -1) })
+        w.activate("a")
+        self.assertIn("a", w.ready)
+
+        # An item that was never built is forgotten as well
+        files["a.c"] = 6
+        w.invalidate("a.c")
+        self.assertNotIn("a", w.out_of_date)
+        self.assertNotIn("a", w.ready)
+        self.assertNotIn("a", w.timestamps)
+
+        w.activate("a")
+        self.assertEqual(w.timestamps["a.c"], 6)
+        self.assertEqual(w.get_item(), "a")
+
+    def test_mark_done_not_handed_out(self):
+
+        files = {"a.c" : 1}
+
+        g = Graph()
+        for name in ["a.c", "a.o", "app"]:
+            g[name] = wType.wFILE
+        g.add_edge("a.o", "a.c")
+        g.add_edge("app", "a.o")
+
+        w = WorkQueue(g, { wType.wFILE : lambda x: files.get(x, -1) })
+        w.activate("app")
+
+        files["a.o"] = 2
+        with self.assertRaises(Exception):
+            w.mark_done("a.o")
+        self.assertNotIn("a.o", w.in_date)
+        self.assertEqual(w.get_item(), "a.o")
+        self.assertIsNone(w.get_item())
+
     def test_invalid_object(self):
 
         with self.assertRaises(TypeError):